@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cpu import Chip8CPU
+from screen import HeadlessScreen
+from rom import check_rom_size
+from library import RomLibrary
+
+
+# Run a ROM headless for a fixed budget and summarize the final state
+# Timers tick every frame; once the ROM waits for a key (Fx0A) no more
+# instructions run, as nobody presses one. Only the instructions that ran
+# are counted. The ROM is read from path unless its data is given.
+def run_rom(path, frames=600, cycles_per_frame=8, data=None):
+    cpu = Chip8CPU(HeadlessScreen(path))
+    if data is None:
+        cpu.load_rom(path)
+    else:
+        check_rom_size(len(data))
+        cpu.write_memory(0x200, data)
+
+    error = None
+    instructions = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(frames):
+            for _ in range(cycles_per_frame):
+                if cpu.key_wait is not None:
+                    break
+                cpu.execute_instruction()
+                instructions += 1
+            cpu.tick_timers()
+    except Exception as exception:
+        error = '%s at %s: %s' % (type(exception).__name__,
+                                  hex(cpu.registers.pc), exception)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'rom': os.path.basename(path),
+        'framebuffer': hashlib.sha1(cpu.screen.to_bytes()).hexdigest(),
+        'instructions': instructions,
+        'unimplemented': {hex(opcode): count for opcode, count
+                          in sorted(cpu.unimplemented.items())},
+        'waiting_for_key': cpu.key_wait is not None,
+        'error': error,
+        'wall_time': elapsed,
+    }
+
+
+# ROM files found in directory
+def find_roms(directory, extension='.ch8'):
+    return sorted(os.path.join(directory, name)
+                  for name in os.listdir(directory)
+                  if name.endswith(extension))
+
+
+# Run every ROM on a process pool, writing one JSON line per result as
+# runs complete. Files with identical content run once; files that can
+# not be read or do not fit in memory get an error line right away.
+def run_batch(roms, output, frames=600, cycles_per_frame=8, workers=None,
+              library=None):
+    library = library or RomLibrary()
+    paths = {}
+    for path in roms:
+        try:
+            sha1 = library.add(path)
+        except (OSError, ValueError) as exception:
+            output.write(json.dumps({
+                'rom': os.path.basename(path),
+                'error': '%s: %s' % (type(exception).__name__, exception),
+            }) + '\n')
+            continue
+
+        paths.setdefault(sha1, []).append(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_rom, same[0], frames, cycles_per_frame,
+                                   library.rom_data(sha1)): sha1
+                   for sha1, same in paths.items()}
+
+        for future in as_completed(futures):
+            sha1 = futures[future]
+            result = future.result()
+            for path in paths[sha1]:
+                result.update(rom=os.path.basename(path), sha1=sha1)
+                output.write(json.dumps(result) + '\n')
+            output.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run a directory of Chip8 ROMs headless')
+    parser.add_argument('directory')
+    parser.add_argument('--frames', type=int, default=600,
+                        help='frames (60 Hz timer ticks) to run each ROM for')
+    parser.add_argument('--cycles', type=int, default=None,
+                        help='instruction budget, overrides --frames')
+    parser.add_argument('--frequency', type=int, default=500,
+                        help='CPU frequency in Hz')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, defaults to all cores')
+    parser.add_argument('--output', default=None,
+                        help='JSON lines file, defaults to stdout')
+    parser.add_argument('--index', default=None,
+                        help='ROM library index file, kept between runs')
+    args = parser.parse_args()
+
+    cycles_per_frame = max(args.frequency // 60, 1)
+    frames = args.frames
+    if args.cycles is not None:
+        frames = -(-args.cycles // cycles_per_frame)
+
+    roms = find_roms(args.directory)
+    library = RomLibrary(args.index)
+    if args.output:
+        with open(args.output, 'w') as output:
+            run_batch(roms, output, frames, cycles_per_frame, args.workers,
+                      library)
+    else:
+        run_batch(roms, sys.stdout, frames, cycles_per_frame, args.workers,
+                  library)
+
+    if args.index:
+        library.save()
@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+from cpu import (Chip8CPU, OPERATIONS, SYSTEM_OPERATIONS, LOGICAL_OPERATIONS,
+                 KEY_OPERATIONS, MISC_OPERATIONS)
+from screen import HeadlessScreen
+from jit import BlockJIT
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ROMS = ['tetris.ch8', 'space_invaders.ch8']
+MACRO_ROMS = ['tetris.ch8', 'space_invaders.ch8', 'chip8_picture.ch8']
+BASELINE = os.path.join(ROOT, 'benchmark_baseline.json')
+
+# Handlers are called in batches, with SP set back to the middle of the
+# stack before each one, so calls and returns never run out of room. The
+# fastest of many short samples is kept, which filters out most of the
+# scheduling noise.
+MICRO_BATCH = 7
+MICRO_SP = 8
+MICRO_SAMPLE_BATCHES = 100
+
+
+# Headless CPU with ROM loaded
+def create_cpu(filename, seed=0):
+    cpu = Chip8CPU(HeadlessScreen(filename), seed)
+    cpu.load_rom(os.path.join(ROOT, filename))
+
+    return cpu
+
+
+# Interpreter: one execute_instruction call per instruction
+def run_interpreter(cpu, cycles):
+    execute_instruction = cpu.execute_instruction
+    for _ in range(cycles):
+        execute_instruction()
+
+    return cycles
+
+
+# Basic block JIT
+def run_jit(cpu, cycles):
+    return BlockJIT(cpu).run(cycles)
+
+
+ENGINES = {
+    'interpreter': run_interpreter,
+    'jit': run_jit,
+}
+
+
+# Instructions per second of engine running filename
+def measure(engine, filename, cycles):
+    cpu = create_cpu(filename)
+
+    start = time.perf_counter()
+    executed = ENGINES[engine](cpu, cycles)
+    elapsed = time.perf_counter() - start
+
+    return executed / elapsed
+
+
+def compare_engines(roms=ROMS, cycles=1000000):
+    results = {}
+    for filename in roms:
+        results[filename] = {
+            engine: measure(engine, filename, cycles) for engine in ENGINES
+        }
+
+        speedup = results[filename]['jit'] / results[filename]['interpreter']
+        print('%-20s interpreter: %10d/s  jit: %10d/s  (%.2fx)' % (
+            filename, results[filename]['interpreter'],
+            results[filename]['jit'], speedup))
+
+    return results
+
+
+# One opcode for every handler the CPU decodes, keyed by handler name
+# Operands are x=0, y=1, kk=0x15, nnn=0x015 and n=5.
+def micro_opcodes():
+    opcodes = {'system_call': 0x0015}
+    tables = [
+        (OPERATIONS, lambda key: (key << 12) | 0x015),
+        (SYSTEM_OPERATIONS, lambda key: key),
+        (LOGICAL_OPERATIONS, lambda key: 0x8010 | key),
+        (KEY_OPERATIONS, lambda key: 0xE000 | key),
+        (MISC_OPERATIONS, lambda key: 0xF000 | key),
+    ]
+    for lookup, encode in tables:
+        for key, name in sorted(lookup.items()):
+            opcodes[name] = encode(key)
+
+    return opcodes
+
+
+# Nanoseconds per call of every handler, called directly with its decoded
+# operands. The loop and call overhead, measured with an empty function,
+# is subtracted.
+def run_micro(calls=70000):
+    cpu = create_cpu(MACRO_ROMS[0])
+    registers = cpu.registers
+    samples = max(calls // (MICRO_BATCH * MICRO_SAMPLE_BATCHES), 1)
+
+    def best(operation):
+        registers.v[:] = bytes(range(0x00, 0x100, 0x10))
+        registers.index = 0x300
+
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter_ns()
+            for _ in range(MICRO_SAMPLE_BATCHES):
+                registers.sp = MICRO_SP
+                for _ in range(MICRO_BATCH):
+                    operation()
+            timings.append(time.perf_counter_ns() - start)
+
+        return min(timings) / (MICRO_SAMPLE_BATCHES * MICRO_BATCH)
+
+    overhead = best(lambda: None)
+    results = {}
+    for name, opcode in micro_opcodes().items():
+        results[name] = {
+            'opcode': '%04X' % opcode,
+            'ns': max(best(cpu.decode(opcode)) - overhead, 0),
+        }
+
+    return results
+
+
+# Nanoseconds per instruction of headless interpreter runs, best of repeat
+def run_macro(roms=MACRO_ROMS, cycles=200000, repeat=5):
+    results = {}
+    for filename in roms:
+        timings = []
+        for _ in range(repeat):
+            cpu = create_cpu(filename)
+            start = time.perf_counter_ns()
+            run_interpreter(cpu, cycles)
+            timings.append(time.perf_counter_ns() - start)
+
+        results[filename] = {'cycles': cycles,
+                             'ns': min(timings) / cycles}
+
+    return results
+
+
+def run_suite(micro_calls=70000, macro_cycles=200000, repeat=5):
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'micro': run_micro(micro_calls),
+        'macro': run_macro(MACRO_ROMS, macro_cycles, repeat),
+    }
+
+
+# Benchmarks slower than the baseline by more than threshold (a ratio),
+# as (level, name, baseline ns, current ns)
+def find_regressions(results, baseline, threshold=0.2):
+    regressions = []
+    for level in ('micro', 'macro'):
+        for name, result in sorted(results[level].items()):
+            reference = baseline.get(level, {}).get(name)
+            if reference is None or reference['ns'] <= 0:
+                continue
+
+            if result['ns'] > reference['ns'] * (1 + threshold):
+                regressions.append((level, name, reference['ns'],
+                                    result['ns']))
+
+    return regressions
+
+
+def report_suite(results, baseline=None):
+    lines = []
+    for level in ('micro', 'macro'):
+        lines.append('%s:' % level.capitalize())
+        for name, result in results[level].items():
+            line = '  %-28s %10.1f ns' % (name, result['ns'])
+            reference = (baseline or {}).get(level, {}).get(name)
+            if reference and reference['ns'] > 0:
+                line += '  (%+.1f%%)' % (
+                    (result['ns'] / reference['ns'] - 1) * 100)
+            lines.append(line)
+
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Chip8 interpreter')
+    parser.add_argument('roms', nargs='*', default=ROMS,
+                        help='ROMs for --engines')
+    parser.add_argument('--engines', action='store_true',
+                        help='compare the interpreter and the JIT instead')
+    parser.add_argument('--cycles', type=int, default=None,
+                        help='instructions per ROM run')
+    parser.add_argument('--calls', type=int, default=70000,
+                        help='calls per opcode handler')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per ROM, the fastest is kept')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='results to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown ratio before failing')
+    args = parser.parse_args()
+
+    if args.engines:
+        compare_engines(args.roms, args.cycles or 1000000)
+        sys.exit(0)
+
+    results = run_suite(args.calls, args.cycles or 200000, args.repeat)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    print(report_suite(results, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print('Baseline saved to %s' % args.baseline)
+    elif baseline is not None:
+        regressions = find_regressions(results, baseline, args.threshold)
+        for level, name, reference, current in regressions:
+            print('Regression: %s %s %.1f ns -> %.1f ns' % (
+                level, name, reference, current))
+        if regressions:
+            sys.exit(1)
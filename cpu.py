@@ -1,374 +1,733 @@
-from random import randint
+import struct
+from array import array
+from random import Random, getrandbits
+from types import MethodType
+from functools import partial
+from keypad import Keypad
+from registers import RegisterFile, create_stack
+from rom import open_rom, check_rom_size
+from fonts import FONT_ADDRESS, BIG_FONT_ADDRESS, FONT_MEMORY
+from screen import LOW_RESOLUTION, HIGH_RESOLUTION
+from quirks import quirk_profile
+
+
+# Operand extraction, by instruction layout
+def no_operands(opcode):
+    return ()
+
+
+def address_operand(opcode):
+    return (opcode & 0x0FFF,)
+
+
+def register_operand(opcode):
+    return ((opcode & 0x0F00) >> 8,)
+
+
+def nibble_operand(opcode):
+    return (opcode & 0x000F,)
+
+
+def register_byte_operands(opcode):
+    return ((opcode & 0x0F00) >> 8, opcode & 0x00FF)
+
+
+def register_pair_operands(opcode):
+    return ((opcode & 0x0F00) >> 8, (opcode & 0x00F0) >> 4)
+
+
+def sprite_operands(opcode):
+    return ((opcode & 0x0F00) >> 8, (opcode & 0x00F0) >> 4, opcode & 0x000F)
+
+
+# Memory at power on, with the built-in fonts from 0x000
+INITIAL_MEMORY = FONT_MEMORY.ljust(4096, b'\x00')
+
+# Save state layout: magic, version, memory, V registers, index, pc, sp,
+# delay and sound timers, register waiting for a key (-1 when none),
+# stack, framebuffer size. The packed framebuffer follows.
+SNAPSHOT_MAGIC = b'C8SS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FORMAT = struct.Struct('<4sB4096s16sHHbBBb16HH')
+
+
+# Operand layout by most significant nibble
+OPERAND_LAYOUTS = {
+    0x0: no_operands,
+    0x1: address_operand,
+    0x2: address_operand,
+    0x3: register_byte_operands,
+    0x4: register_byte_operands,
+    0x5: register_pair_operands,
+    0x6: register_byte_operands,
+    0x7: register_byte_operands,
+    0x8: register_pair_operands,
+    0x9: register_pair_operands,
+    0xA: address_operand,
+    0xB: address_operand,
+    0xC: register_byte_operands,
+    0xD: sprite_operands,
+    0xE: register_operand,
+    0xF: register_operand,
+}
+
+# Operand layouts of handlers that differ from the layout of their nibble
+HANDLER_LAYOUTS = {
+    'scroll_down': nibble_operand,
+    'scroll_up': nibble_operand,
+}
+
+# Handlers by most significant nibble
+# 0x0, 0x8, 0xE and 0xF are resolved through the sub operation tables
+# below.
+OPERATIONS = {
+    0x1: 'jump_to_location',
+    0x2: 'call_subroutine',
+    0x3: 'skip_if_equal',
+    0x4: 'skip_if_not_equal',
+    0x5: 'skip_if_registers_equal',
+    0x6: 'set_register',
+    0x7: 'add_to_register',
+    0x9: 'skip_if_registers_not_equal',
+    0xA: 'set_index',
+    0xB: 'jump_to_location_plus_v0',
+    0xC: 'rand_vx',
+    0xD: 'draw_sprite',
+}
+
+# System operations, by the low 12 bits; anything else is 0nnn
+SYSTEM_OPERATIONS = {
+    0x0E0: 'clear',
+    0x0EE: 'return_from_subroutine',
+    0x0FB: 'scroll_right',
+    0x0FC: 'scroll_left',
+    0x0FE: 'low_resolution',
+    0x0FF: 'high_resolution',
+}
+# 00Cn and 00Dn scroll the display n lines down and up
+SYSTEM_OPERATIONS.update((0x0C0 | n, 'scroll_down') for n in range(0x10))
+SYSTEM_OPERATIONS.update((0x0D0 | n, 'scroll_up') for n in range(0x10))
+
+# Logical operations, by the low nibble
+LOGICAL_OPERATIONS = {
+    0x0: 'load_vy_into_vx',
+    0x1: 'load_or_vy_into_vx',
+    0x2: 'load_and_vy_into_vx',
+    0x3: 'load_xor_vy_into_vx',
+    0x4: 'add_vy_to_vx',
+    0x5: 'subtract_vy_from_vx',
+    0x6: 'shr_vx',
+    0x7: 'subtract_vx_from_vy',
+    0xE: 'shl_vx',
+}
+
+# Key operations, by the low byte
+KEY_OPERATIONS = {
+    0x9E: 'skip_if_key_pressed',
+    0xA1: 'skip_if_key_not_pressed',
+}
+
+# Misc operations, by the low byte
+MISC_OPERATIONS = {
+    0x07: 'load_delay_timer_into_vx',
+    0x0A: 'wait_for_key',
+    0x15: 'set_delay_timer',
+    0x18: 'set_sound_timer',
+    0x1E: 'add_vx_to_index',
+    0x29: 'set_index_to_font',
+    0x30: 'set_index_to_big_font',
+    0x33: 'store_bcd',
+    0x55: 'store_registers',
+    0x65: 'load_registers',
+}
+
+
+# Name of the handler of opcode, None when there is none
+def handler_name(opcode):
+    operation = (opcode & 0xF000) >> 12
+
+    if operation == 0x0:
+        return SYSTEM_OPERATIONS.get(opcode & 0x0FFF, 'system_call')
+    if operation == 0x8:
+        return LOGICAL_OPERATIONS.get(opcode & 0x000F)
+    if operation == 0xE:
+        return KEY_OPERATIONS.get(opcode & 0x00FF)
+    if operation == 0xF:
+        return MISC_OPERATIONS.get(opcode & 0x00FF)
+
+    return OPERATIONS[operation]
+
+
+# (handler, operands) for every 16 bit opcode, None for opcodes without
+# handler. Handlers are plain functions, bound to a CPU when decoded;
+# quirks maps handler names to the variants replacing them.
+# Operands only depend on the low 12 bits, so they are extracted once per
+# layout and shared between opcodes.
+def build_dispatch_table(cls, quirks={}):
+    operands = {}
+    layouts = set(OPERAND_LAYOUTS.values()) | set(HANDLER_LAYOUTS.values())
+    for layout in layouts:
+        operands[layout] = [layout(low) for low in range(0x1000)]
+
+    table = []
+    for operation in range(0x10):
+        layout_operands = operands[OPERAND_LAYOUTS[operation]]
+        if operation in OPERATIONS:
+            name = OPERATIONS[operation]
+            handler = getattr(cls, quirks.get(name, name))
+            table.extend((handler, extracted) for extracted in layout_operands)
+            continue
+
+        for low in range(0x1000):
+            name = handler_name((operation << 12) | low)
+            if name is None:
+                table.append(None)
+                continue
+
+            layout = HANDLER_LAYOUTS.get(name)
+            table.append((getattr(cls, quirks.get(name, name)),
+                          layout_operands[low] if layout is None else
+                          operands[layout][low]))
+
+    return table
+
+
+# Dispatch table of a quirk profile, built on first use
+def dispatch_table(quirks=None):
+    table = DISPATCH_TABLES.get(quirks)
+    if table is None:
+        table = DISPATCH_TABLES[quirks] = build_dispatch_table(
+            Chip8CPU, quirk_profile(quirks))
+
+    return table
 
 
 class Chip8CPU(object):
-    def __init__(self, screen):
+    def __init__(self, screen, seed=None, quirks=None):
         self.operand = 0
         self.screen = screen
-        self.memory = bytearray(4096)
-
-        # Delay and Sound timers
-        self.timers = {
-            'delay': 0,
-            'sound': 0,
-        }
-
-        # Registers
-        self.registers = {
-            'v': [],
-            'index': 0,
-            'sp': 0,
-            'pc': 0,
-        }
-
-        self.stack = []
-
-        # Operations Lookup
-        self.operations = {
-            0x0: self.clear_return,
-            0x1: self.jump_to_location,
-            0x2: self.call_subroutine,
-            0x3: self.skip_instruction,
-            0x4: self.skip_instruction,
-            0x5: self.skip_instruction,
-            0x6: self.set_register,
-            0x7: self.add_to_register,
-            0x8: self.execute_logical_operation,
-            0x9: self.skip_instruction,
-            0xA: self.set_index,
-            0xB: self.jump_to_location_plus_v0,
-            0xC: self.rand_vx,
-            0xD: self.draw_sprite,
-            0xF: self.execute_misc_operation,
-        }
-
-        # Logical operations lookup
-        self.logical_operation_lookup = {
-            0x0: self.load_vy_into_vx,
-            0x1: self.load_or_vy_into_vx,
-            0x2: self.load_and_vy_into_vx,
-            0x3: self.load_xor_vy_into_vx,
-            0x4: self.add_vy_to_vx,
-            0x5: self.subtract_vy_from_vx,
-            0x6: self.shr_vx,
-            0x7: self.subtract_vx_from_vy,
-            0x8: self.shl_vx,
-        }
-
-        # Misc operations lookup
-        self.misc_operation_lookup = {
-            0x15: self.set_delay_timer,
-            0x1E: self.add_vx_to_index,
-        }
+        self.random = Random(seed if seed is not None else getrandbits(64))
+        self.memory = bytearray(INITIAL_MEMORY)
+
+        # Registers, including the delay and sound timers
+        self.registers = RegisterFile()
+        self.timers = self.registers
+        self.stack = create_stack()
+
+        self.hooks = []
+        self.write_listeners = []
+
+        # Hit count of opcodes without handler
+        self.unimplemented = {}
+
+        # Keypad, and register waiting for a key press (Fx0A)
+        self.keypad = Keypad()
+        self.keypad.listeners.append(self.key_pressed)
+        self.key_wait = None
+
+        # Handlers of every opcode, with the variants of the quirk profile
+        self.quirks = quirks
+        self.dispatch_table = dispatch_table(quirks)
+
+        # Decoded instructions, indexed by address
+        self.decode_cache = [None] * 4096
 
         self.reset()
 
     # Reset CPU
     def reset(self):
-        self.registers['v'] = [0] * 16
-        self.registers['pc'] = 0x0200
-        self.registers['sp'] = 0
-        self.registers['index'] = 0
-
-        self.timers['delay'] = 0
-        self.timers['sound'] = 0
-
-        self.stack = [0] * 16
+        self.registers.reset()
+        self.stack[:] = create_stack()
+        self.key_wait = None
+
+    # Serialize the machine state into a compact binary blob
+    def snapshot(self):
+        registers = self.registers
+        framebuffer = self.screen.to_bytes()
+
+        return SNAPSHOT_FORMAT.pack(
+            SNAPSHOT_MAGIC,
+            SNAPSHOT_VERSION,
+            bytes(self.memory),
+            bytes(registers.v),
+            registers.index,
+            registers.pc,
+            registers.sp,
+            registers.delay,
+            registers.sound,
+            -1 if self.key_wait is None else self.key_wait,
+            *self.stack,
+            len(framebuffer)
+        ) + framebuffer
+
+    # Restore a state produced by snapshot
+    def restore(self, data):
+        fields = SNAPSHOT_FORMAT.unpack_from(data)
+        magic, version, memory, v, index, pc, sp, delay, sound, key_wait = \
+            fields[:10]
+        stack = fields[10:26]
+        framebuffer_size = fields[26]
+
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported snapshot format')
+
+        if self.memory != memory:
+            self.write_memory(0, memory)
+
+        registers = self.registers
+        registers.v[:] = v
+        registers.index = index
+        registers.pc = pc
+        registers.sp = sp
+        registers.delay = delay
+        registers.sound = sound
+        self.key_wait = None if key_wait == -1 else key_wait
+        self.stack[:] = array('H', stack)
+
+        start = SNAPSHOT_FORMAT.size
+        self.screen.from_bytes(data[start:start + framebuffer_size])
+
+    # Decrement delay and sound timers, called at 60 Hz
+    def tick_timers(self):
+        registers = self.registers
+        if registers.delay > 0:
+            registers.delay -= 1
+
+        if registers.sound > 0:
+            registers.sound -= 1
 
     # Load ROM File into memory
     def load_rom(self, filename, offset=0x200):
-        with open(filename, 'rb') as file:
-            data = file.read()
-            for index, val in enumerate(data):
-                self.memory[offset + index] = val
+        with open_rom(filename) as data:
+            check_rom_size(len(data), offset)
+            self.write_memory(offset, data)
 
     # Load Fontset
     def load_font(self, font):
-        for index, data in enumerate(font):
-            self.memory[index] = data
+        self.write_memory(0, bytes(font))
 
     # Execute Instruction base on most significant byte
     def execute_instruction(self):
-        self.operand = int(self.memory[self.registers['pc']])
-        self.operand = self.operand << 8
-        self.operand += int(self.memory[self.registers['pc'] + 1])
-        self.registers['pc'] += 2
-
-        operation = (self.operand & 0xF000) >> 12
-        try:
-            v_debug = {'v[%s]' % index: hex(
-                value) for index, value in enumerate(self.registers['v'])}
-            stack_debug = {'s[%s]' % index: hex(
-                value) for index, value in enumerate(self.stack)}
-            debug_info = {
-                'pc': hex(self.registers['pc']),
-                'v': v_debug,
-                'stack': stack_debug,
-                'index': hex(self.registers['index']),
-                'sp': hex(self.registers['sp']),
-                'operand': '%s (%s)' % (hex(self.operand), hex(operation)),
-                'sprite': bin(self.memory[self.registers['index']]),
-            }
-            self.screen.update_debug_info(debug_info)
-            self.operations[operation]()
-        except KeyError:
-            self.screen.update_debug_info({
-                'pc': '%s (Operation not implemented [%s])' % (hex(self.registers['pc']), hex(self.operand))
-            })
+        registers = self.registers
+        pc = registers.pc
+        entry = self.decode_cache[pc]
+        if entry is None:
+            entry = self.decode_cache[pc] = self.decode_at(pc)
+
+        self.operand, operation = entry
+        registers.pc = pc + 2
+        operation()
+
+    # Decode the instruction stored at address
+    def decode_at(self, address):
+        opcode = (self.memory[address] << 8) | self.memory[address + 1]
+        return opcode, self.decode(opcode)
+
+    # Resolve opcode into its handler, bound to the extracted operands
+    def decode(self, opcode):
+        entry = self.dispatch_table[opcode]
+        if entry is None:
+            return partial(self.not_implemented, opcode)
+
+        handler, operands = entry
+        return partial(MethodType(handler, self), *operands)
+
+    # Drop cached decodes overlapping the address range [start, end)
+    def invalidate(self, start, end):
+        start = max(start - 1, 0)
+        end = min(end, len(self.decode_cache))
+        self.decode_cache[start:end] = [None] * (end - start)
+
+        for listener in self.write_listeners:
+            listener(start, end)
+
+    # Drop every decoded instruction, memory is untouched
+    def flush_decode_cache(self):
+        self.decode_cache = [None] * len(self.decode_cache)
+
+    # Write data into memory, keeping the decode cache coherent
+    def write_memory(self, address, data):
+        end = address + len(data)
+        if address < 0 or end > len(self.memory):
+            raise IndexError('Write to %s past the end of memory' %
+                             hex(address))
+
+        self.memory[address:end] = data
+        self.invalidate(address, end)
+
+    # Count and report opcodes without handler
+    def not_implemented(self, opcode):
+        self.unimplemented[opcode] = self.unimplemented.get(opcode, 0) + 1
+        self.screen.update_debug_info({
+            'pc': '%s (Operation not implemented [%s])' % (hex(self.registers.pc), hex(opcode))
+        })
+
+    # Instruction hooks
+    # Hooks are called with the CPU before every instruction. While no hook
+    # is attached, execute_instruction is the plain class method.
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        self.execute_instruction = self.execute_hooked_instruction
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+        if not self.hooks:
+            del self.execute_instruction
+
+    def execute_hooked_instruction(self):
+        for hook in self.hooks:
+            hook(self)
+
+        type(self).execute_instruction(self)
 
     # Operations
-    def clear_return(self):
-        operation = self.operand & 0x00FF
-
-        if operation == 0x00E0:
-            self.clear()
-
-        elif operation == 0x00EE:
-            self.return_from_subroutine()
-
-    # Misc operations seek and execution
-    def execute_misc_operation(self):
-        sub_operation = self.operand & 0x00FF
-        self.misc_operation_lookup[sub_operation]()
-
-    # Logical operations seek and execution
-    def execute_logical_operation(self):
-        sub_operation = self.operand & 0x000F
-        self.logical_operation_lookup[sub_operation]()
+    # Ignored machine code routine
+    # 0nnn - SYS addr
+    def system_call(self):
+        pass
 
     # Clear Screen
     # 00E0 - CLS
     def clear(self):
         self.screen.clear()
 
-    # Return from subroutine
+    # Return from subroutine, an empty stack is a fault
     # 00EE - RET
     def return_from_subroutine(self):
-        self.registers['pc'] = self.stack[self.registers['sp']]
-        self.registers['sp'] -= 1
+        registers = self.registers
+        if registers.sp == 0:
+            raise IndexError('Return with an empty stack')
+
+        registers.pc = self.stack[registers.sp]
+        registers.sp -= 1
+
+    # Scroll the display n lines down
+    # 00Cn - SCD nibble
+    def scroll_down(self, n):
+        self.screen.scroll_down(n)
+
+    # Scroll the display n lines up
+    # 00Dn - SCU nibble
+    def scroll_up(self, n):
+        self.screen.scroll_up(n)
+
+    # Scroll the display 4 pixels right
+    # 00FB - SCR
+    def scroll_right(self):
+        self.screen.scroll_right(4)
+
+    # Scroll the display 4 pixels left
+    # 00FC - SCL
+    def scroll_left(self):
+        self.screen.scroll_left(4)
+
+    # Switch to the 64x32 display
+    # 00FE - LOW
+    def low_resolution(self):
+        self.screen.set_resolution(LOW_RESOLUTION)
+
+    # Switch to the 128x64 SUPER-CHIP display
+    # 00FF - HIGH
+    def high_resolution(self):
+        self.screen.set_resolution(HIGH_RESOLUTION)
 
     # Jump to location
     # 1nnn - JP addr
-    def jump_to_location(self, address=None):
-        addr = address if address else self.operand & 0x0FFF
-        self.registers['pc'] = addr
+    def jump_to_location(self, address):
+        self.registers.pc = address
 
     # Call subroutine
     # 2nnn - CALL addr
-    def call_subroutine(self):
-        self.registers['sp'] += 1
-        self.stack[self.registers['sp']] = self.registers['pc']
-        address = (self.operand & 0x0FFF)
-        self.jump_to_location(address)
-
-    # Skip instruction based on operation
-    def skip_instruction(self):
-        sub_operation = self.operand & 0xF000
-        x = (self.operand & 0x0F00) >> 8
-        y = (self.operand & 0x00F0) >> 4
-        kk = self.operand & 0x00FF
-
-        should_skip = False
-
-        # 3xkk - SE Vx, byte
-        if sub_operation == 0x3000:
-            should_skip = self.registers['v'][x] == kk
-
-        # 4xkk - SNE Vx, byte
-        elif sub_operation == 0x4000:
-            should_skip = self.registers['v'][x] != kk
-
-        # 5xy0 - SE Vx, Vy
-        elif sub_operation == 0x5000:
-            should_skip = self.registers['v'][x] == self.registers['v'][y]
-
-        # 9xy0 - SNE Vx, Vy
-        elif sub_operation == 0x9000:
-            should_skip = self.registers['v'][x] != self.registers['v'][y]
-
-        self.registers['pc'] += 2 if should_skip else 0
+    def call_subroutine(self, address):
+        registers = self.registers
+        registers.sp += 1
+        self.stack[registers.sp] = registers.pc
+        registers.pc = address
+
+    # Skip next instruction if vx equals kk
+    # 3xkk - SE Vx, byte
+    def skip_if_equal(self, x, kk):
+        registers = self.registers
+        if registers.v[x] == kk:
+            registers.pc += 2
+
+    # Skip next instruction if vx not equals kk
+    # 4xkk - SNE Vx, byte
+    def skip_if_not_equal(self, x, kk):
+        registers = self.registers
+        if registers.v[x] != kk:
+            registers.pc += 2
+
+    # Skip next instruction if vx equals vy
+    # 5xy0 - SE Vx, Vy
+    def skip_if_registers_equal(self, x, y):
+        registers = self.registers
+        if registers.v[x] == registers.v[y]:
+            registers.pc += 2
+
+    # Skip next instruction if vx not equals vy
+    # 9xy0 - SNE Vx, Vy
+    def skip_if_registers_not_equal(self, x, y):
+        registers = self.registers
+        if registers.v[x] != registers.v[y]:
+            registers.pc += 2
 
     # Set register to value
     # 6xkk - LD Vx, byte
-    def set_register(self, value=None):
-        x = (self.operand & 0x0F00) >> 8
-        value_to_set = value if value else (self.operand & 0x00FF)
-
-        self.registers['v'][x] = value_to_set
+    def set_register(self, x, value):
+        self.registers.v[x] = value
 
-    # Add value to register
+    # Add value to register, VF is untouched
     # 7xkk - ADD Vx, byte
-    def add_to_register(self, value=None):
-        x = (self.operand & 0x0F00) >> 8
-        value_to_add = value if value else (self.operand & 0x00FF)
-        result = self.registers['v'][x] + value_to_add
-
-        if result > 255:
-            self.registers['v'][0xF] = self.registers['v'][0xF] | 1
-            result = 0x000F & result
-        else:
-            self.registers['v'][0xF] = self.registers['v'][0xF] & 0
-
-        self.registers['v'][x] = result
-
-    # Subtract value from register
-    def subtract_from_register(self, value=None, register_index=None):
-        x = (self.operand & 0x0F00) >> 8
-        reg_index = register_index if register_index else x
-        value_to_subtract = value if value else (self.operand & 0x00FF)
-        result = self.registers['v'][reg_index] - value_to_subtract
-
-        if result < 0:
-            self.registers['v'][0xF] = self.registers['v'][0xF] | 1
-            result += 255
-        else:
-            self.registers['v'][0xF] = self.registers['v'][0xF] & 0
-
-        self.registers['v'][x] = result
+    def add_to_register(self, x, value):
+        v = self.registers.v
+        v[x] = (v[x] + value) & 0xFF
 
     # Load value of register vy into register vx
     # 8xy0 - LD Vx, Vy
-    def load_vy_into_vx(self):
-        y = (self.operand & 0x00F0) >> 4
-
-        self.set_register(self.registers['v'][y])
+    def load_vy_into_vx(self, x, y):
+        v = self.registers.v
+        v[x] = v[y]
 
     # Load value of vx OR vy into register vx
     # 8xy1 - OR Vx, Vy
-    def load_or_vy_into_vx(self):
-        y = (self.operand & 0x00F0) >> 4
-        x = (self.operand & 0x0F00) >> 8
-        value = self.registers['v'][x] | self.registers['v'][y]
+    def load_or_vy_into_vx(self, x, y):
+        v = self.registers.v
+        v[x] = v[x] | v[y]
 
-        self.set_register(value)
+    def load_or_vy_into_vx_reset_vf(self, x, y):
+        v = self.registers.v
+        v[x] = v[x] | v[y]
+        v[0xF] = 0
 
     # Load value of vx AND vy into register vx
     # 8xy2 - AND Vx, Vy
-    def load_and_vy_into_vx(self):
-        y = (self.operand & 0x00F0) >> 4
-        x = (self.operand & 0x0F00) >> 8
-        value = self.registers['v'][x] & self.registers['v'][y]
+    def load_and_vy_into_vx(self, x, y):
+        v = self.registers.v
+        v[x] = v[x] & v[y]
 
-        self.set_register(value)
+    def load_and_vy_into_vx_reset_vf(self, x, y):
+        v = self.registers.v
+        v[x] = v[x] & v[y]
+        v[0xF] = 0
 
     # Load value of vx XOR vy into register vx
     # 8xy3 - XOR Vx, Vy
-    def load_xor_vy_into_vx(self):
-        y = (self.operand & 0x00F0) >> 4
-        x = (self.operand & 0x0F00) >> 8
-        value = self.registers['v'][x] ^ self.registers['v'][y]
+    def load_xor_vy_into_vx(self, x, y):
+        v = self.registers.v
+        v[x] = v[x] ^ v[y]
 
-        self.set_register(value)
+    def load_xor_vy_into_vx_reset_vf(self, x, y):
+        v = self.registers.v
+        v[x] = v[x] ^ v[y]
+        v[0xF] = 0
 
-    # Adds value of vy to vx and stores the result into vx
+    # Adds value of vy to vx, VF is set on carry
+    # Flags are written after the result, so they win when x is F.
     # 8xy4 - ADD Vx, Vy
-    def add_vy_to_vx(self):
-        y = (self.operand & 0x00F0) >> 4
+    def add_vy_to_vx(self, x, y):
+        v = self.registers.v
+        result = v[x] + v[y]
+        v[x] = result & 0xFF
+        v[0xF] = result >> 8
 
-        self.add_to_register(self.registers['v'][y])
-
-    # Subtracts value of vy from vx and stores the result into vx
+    # Subtracts value of vy from vx, VF is cleared on borrow
     # 8xy5 - SUB Vx, Vy
-    def subtract_vy_from_vx(self):
-        y = (self.operand & 0x00F0) >> 4
-
-        self.subtract_from_register(self.registers['v'][y])
-
-    # Divides the value of vx depending on its lsb
-    # 8xy6 - SHR Vx {, Vy}
-    def shr_vx(self):
-        x = (self.operand & 0x0F00) >> 8
-        vx_lsb = bin(self.registers['v'][x] & 0x000F)
-        vx_lsb = int(vx_lsb[-1])
-
-        if vx_lsb == 1:
-            self.registers['v'][0xF] = self.registers['v'][0xF] | 1
-        else:
-            self.registers['v'][0xF] = self.registers['v'][0xF] & 0
-
-        self.registers['v'][x] = self.registers['v'][x] // 2
-
-    # Substracts the value of vx from vy and stores the result into vx
+    def subtract_vy_from_vx(self, x, y):
+        v = self.registers.v
+        result = v[x] - v[y]
+        v[x] = result & 0xFF
+        v[0xF] = result >= 0
+
+    # Substracts value of vx from vy and stores the result into vx, VF is
+    # cleared on borrow
     # 8xy7 - SUBN Vx, Vy
-    def subtract_vx_from_vy(self):
-        y = (self.operand & 0x00F0) >> 4
-        x = (self.operand & 0x0F00) >> 8
-
-        self.subtract_from_register(self.registers['v'][x], y)
+    def subtract_vx_from_vy(self, x, y):
+        v = self.registers.v
+        result = v[y] - v[x]
+        v[x] = result & 0xFF
+        v[0xF] = result >= 0
 
-    # Multiplies the value of vx based on its msb
+    # Shift vx right, VF is the bit shifted out
+    # 8xy6 - SHR Vx {, Vy}
+    def shr_vx(self, x, y):
+        v = self.registers.v
+        value = v[x]
+        v[x] = value >> 1
+        v[0xF] = value & 1
+
+    # Shift vy right into vx
+    def shr_vy(self, x, y):
+        v = self.registers.v
+        value = v[y]
+        v[x] = value >> 1
+        v[0xF] = value & 1
+
+    # Shift vx left, VF is the bit shifted out
     # 8xyE - SHL Vx {, Vy}
-    def shl_vx(self):
-        x = (self.operand & 0x0F00) >> 8
-        vx_msb = bin((self.registers['v'][x] & 0xF000) >> 12)
-        vx_msb = int(vx_msb[0])
-
-        if vx_msb == 1:
-            self.registers['v'][0xF] = self.registers['v'][0xF] | 1
-        else:
-            self.registers['v'][0xF] = self.registers['v'][0xF] & 0
-
-        self.registers['v'][x] = self.registers['v'][x] * 2
+    def shl_vx(self, x, y):
+        v = self.registers.v
+        value = v[x]
+        v[x] = (value << 1) & 0xFF
+        v[0xF] = value >> 7
+
+    # Shift vy left into vx
+    def shl_vy(self, x, y):
+        v = self.registers.v
+        value = v[y]
+        v[x] = (value << 1) & 0xFF
+        v[0xF] = value >> 7
 
     # Set index register value
     # Annn - LD I, addr
-    def set_index(self):
-        value = self.operand & 0x0FFF
-
-        self.registers['index'] = value
+    def set_index(self, value):
+        self.registers.index = value
 
     # Jump to address plus value of register v0
     # Bnnn - JP V0, addr
-    def jump_to_location_plus_v0(self):
-        addr = (self.operand & 0x0FFF) + self.registers['v'][0]
-
-        self.jump_to_location(addr)
+    def jump_to_location_plus_v0(self, address):
+        registers = self.registers
+        registers.pc = address + registers.v[0]
+
+    # Jump to address plus value of register vx, x being the high nibble
+    # of the address
+    # Bxnn - JP Vx, addr
+    def jump_to_location_plus_vx(self, address):
+        registers = self.registers
+        registers.pc = address + registers.v[address >> 8]
+
+    # Skip next instruction if key vx is pressed
+    # Ex9E - SKP Vx
+    def skip_if_key_pressed(self, x):
+        registers = self.registers
+        if self.keypad.state[registers.v[x] & 0xF]:
+            registers.pc += 2
+
+    # Skip next instruction if key vx is not pressed
+    # ExA1 - SKNP Vx
+    def skip_if_key_not_pressed(self, x):
+        registers = self.registers
+        if not self.keypad.state[registers.v[x] & 0xF]:
+            registers.pc += 2
+
+    # Wait for a key press and store it into vx
+    # Fx0A - LD Vx, K
+    # The instruction keeps PC on itself and flags key_wait, so the
+    # scheduler stops running the CPU until key_pressed resumes it.
+    def wait_for_key(self, x):
+        self.registers.pc -= 2
+        self.key_wait = x
+
+    # Keypad listener
+    def key_pressed(self, key):
+        if self.key_wait is not None:
+            registers = self.registers
+            registers.v[self.key_wait] = key
+            registers.pc += 2
+            self.key_wait = None
+
+    # Load value of delay timer into vx
+    # Fx07 - LD Vx, DT
+    def load_delay_timer_into_vx(self, x):
+        registers = self.registers
+        registers.v[x] = registers.delay
 
     # Set delay timer
     # Fx15 - LD DT, Vx
-    def set_delay_timer(self):
-        x = (self.operand & 0x0F00) >> 8
-        self.timers['delay'] = self.registers['v'][x]
+    def set_delay_timer(self, x):
+        registers = self.registers
+        registers.delay = registers.v[x]
 
-    # Add value of register vx to index register
+    # Add value of register vx to index register, I wraps at 16 bits
     # Fx1E - ADD I, Vx
-    def add_vx_to_index(self):
-        x = (self.operand & 0x0F00) >> 8
-        self.registers['index'] += self.registers['v'][x]
-
-    # Set random number to vx
+    def add_vx_to_index(self, x):
+        registers = self.registers
+        registers.index = (registers.index + registers.v[x]) & 0xFFFF
+
+    # Set sound timer
+    # Fx18 - LD ST, Vx
+    def set_sound_timer(self, x):
+        registers = self.registers
+        registers.sound = registers.v[x]
+
+    # Point index register to the font sprite of digit vx
+    # Fx29 - LD F, Vx
+    def set_index_to_font(self, x):
+        registers = self.registers
+        registers.index = FONT_ADDRESS + (registers.v[x] & 0xF) * 5
+
+    # Point index register to the big font sprite of digit vx
+    # Fx30 - LD HF, Vx
+    def set_index_to_big_font(self, x):
+        registers = self.registers
+        registers.index = BIG_FONT_ADDRESS + (registers.v[x] & 0xF) * 10
+
+    # Store the decimal digits of vx at index, index + 1 and index + 2
+    # Fx33 - LD B, Vx
+    def store_bcd(self, x):
+        registers = self.registers
+        value = registers.v[x]
+        self.write_memory(registers.index,
+                          bytes((value // 100, value // 10 % 10, value % 10)))
+
+    # Store registers v0 to vx in memory from index
+    # Fx55 - LD [I], Vx
+    def store_registers(self, x):
+        registers = self.registers
+        self.write_memory(registers.index, registers.v[:x + 1])
+
+    def store_registers_advance_index(self, x):
+        self.store_registers(x)
+        self.registers.index += x + 1
+
+    def store_registers_advance_index_by_x(self, x):
+        self.store_registers(x)
+        self.registers.index += x
+
+    # Load registers v0 to vx from memory at index
+    # Fx65 - LD Vx, [I]
+    def load_registers(self, x):
+        registers = self.registers
+        index = registers.index
+        if index + x + 1 > len(self.memory):
+            raise IndexError('Read from %s past the end of memory' %
+                             hex(index))
+
+        registers.v[:x + 1] = self.memory[index:index + x + 1]
+
+    def load_registers_advance_index(self, x):
+        self.load_registers(x)
+        self.registers.index += x + 1
+
+    def load_registers_advance_index_by_x(self, x):
+        self.load_registers(x)
+        self.registers.index += x
+
+    # Set a random number AND kk to vx
     # Cxkk - RND Vx, byte
-    def rand_vx(self):
-        x = (self.operand & 0x0F00) >> 8
-        self.registers['v'][x] = randint(0, 255)
+    def rand_vx(self, x, kk):
+        self.registers.v[x] = self.random.randint(0, 255) & kk
+
     # Draw Sprite to Screen
+    # Dxyn - DRW Vx, Vy, nibble
+    # Dxy0 draws a SUPER-CHIP 16x16 sprite, two bytes per row.
+    def draw_sprite(self, x, y, num_bytes):
+        registers = self.registers
+        index = registers.index
+
+        if num_bytes:
+            sprite = self.memory[index:index + num_bytes]
+            sprite_width = 8
+        else:
+            data = self.memory[index:index + 32]
+            sprite = [(data[offset] << 8) | data[offset + 1]
+                      for offset in range(0, len(data) - 1, 2)]
+            sprite_width = 16
+
+        registers.v[0xF] = self.screen.draw_sprite(
+            registers.v[x], registers.v[y], sprite, sprite_width)
+
 
-    def draw_sprite(self):
-        x_source = (self.operand & 0x0F00) >> 8
-        y_source = (self.operand & 0x00F0) >> 4
-        x_pos = self.registers['v'][x_source]
-        y_pos = self.registers['v'][y_source]
-        num_bytes = self.operand & 0x000F
-        self.registers['v'][0xF] = 0
-
-        self.draw_to_screen(x_pos, y_pos, num_bytes)
-
-    # Draw to screen using screen interface
-    def draw_to_screen(self, x_pos, y_pos, num_bytes):
-        for y_index in range(num_bytes):
-            pixel_line = bin(self.memory[self.registers['index'] + y_index])
-            pixel_line = pixel_line[2:].zfill(8)
-            y_coord = y_pos + y_index
-            for x_index in range(8):
-                x_coord = x_pos + x_index
-                pixel = int(pixel_line[x_index])
-
-                is_active = self.screen.get_pixel(x_coord, y_coord)
-                if pixel == 1 and is_active == 1:
-                    self.registers['v'][0xF] = self.registers['v'][0xF] | 1
-                    pixel = 0
-
-                elif pixel == 0 and is_active == 1:
-                    pixel = 1
-
-                self.screen.draw_pixel(x_coord, y_coord, pixel)
+# Dispatch tables by quirk profile
+DISPATCH_TABLE = build_dispatch_table(Chip8CPU)
+DISPATCH_TABLES = {None: DISPATCH_TABLE}
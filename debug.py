@@ -0,0 +1,76 @@
+# Sampling modes
+OFF = 'off'
+EVERY = 'every'
+FRAME = 'frame'
+BREAKPOINT = 'breakpoint'
+
+
+# Build debug information from the current CPU state
+def debug_snapshot(cpu):
+    registers = cpu.registers
+    operand = cpu.operand
+
+    v_debug = {'v[%s]' % index: hex(
+        value) for index, value in enumerate(registers.v)}
+    stack_debug = {'s[%s]' % index: hex(
+        value) for index, value in enumerate(cpu.stack)}
+
+    return {
+        'pc': hex(registers.pc),
+        'v': v_debug,
+        'stack': stack_debug,
+        'index': hex(registers.index),
+        'sp': hex(registers.sp),
+        'operand': '%s (%s)' % (hex(operand), hex((operand & 0xF000) >> 12)),
+        'sprite': bin(cpu.memory[registers.index & 0x0FFF]),
+    }
+
+
+# Decides when the debug pane is refreshed. The snapshot is only built
+# when it is going to be displayed, so the interpreter does not pay for
+# it on every instruction.
+class DebugSampler(object):
+    def __init__(self, cpu, screen, mode=FRAME, interval=1000,
+                 breakpoints=()):
+        self.cpu = cpu
+        self.screen = screen
+        self.interval = interval
+        self.breakpoints = set(breakpoints)
+        self.mode = OFF
+        self.counter = 0
+
+        self.set_mode(mode)
+
+    # Change sampling mode, attaching or detaching the CPU hook
+    def set_mode(self, mode):
+        if mode not in (OFF, EVERY, FRAME, BREAKPOINT):
+            raise ValueError('Unknown debug sampling mode: %s' % mode)
+
+        if self.mode in (EVERY, BREAKPOINT):
+            self.cpu.remove_hook(self.on_instruction)
+
+        self.mode = mode
+        self.counter = 0
+
+        if mode in (EVERY, BREAKPOINT):
+            self.cpu.add_hook(self.on_instruction)
+
+    # Take a snapshot and show it
+    def sample(self):
+        self.screen.update_debug_info(debug_snapshot(self.cpu))
+
+    # Called before every instruction while in every/breakpoint mode
+    def on_instruction(self, cpu):
+        if self.mode == EVERY:
+            self.counter += 1
+            if self.counter >= self.interval:
+                self.counter = 0
+                self.sample()
+
+        elif cpu.registers.pc in self.breakpoints:
+            self.sample()
+
+    # Called by the main loop whenever a frame is presented
+    def frame(self):
+        if self.mode == FRAME:
+            self.sample()
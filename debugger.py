@@ -0,0 +1,406 @@
+import cmd
+import argparse
+from profiler import opcode_class
+
+
+# Assembly syntax by opcode class
+MNEMONICS = {
+    '00E0': 'CLS',
+    '00EE': 'RET',
+    '00Cn': 'SCD {n}',
+    '00Dn': 'SCU {n}',
+    '00FB': 'SCR',
+    '00FC': 'SCL',
+    '00FE': 'LOW',
+    '00FF': 'HIGH',
+    '0nnn': 'SYS {nnn}',
+    '1nnn': 'JP {nnn}',
+    '2nnn': 'CALL {nnn}',
+    '3xkk': 'SE V{x}, {kk}',
+    '4xkk': 'SNE V{x}, {kk}',
+    '5xy0': 'SE V{x}, V{y}',
+    '6xkk': 'LD V{x}, {kk}',
+    '7xkk': 'ADD V{x}, {kk}',
+    '8xy0': 'LD V{x}, V{y}',
+    '8xy1': 'OR V{x}, V{y}',
+    '8xy2': 'AND V{x}, V{y}',
+    '8xy3': 'XOR V{x}, V{y}',
+    '8xy4': 'ADD V{x}, V{y}',
+    '8xy5': 'SUB V{x}, V{y}',
+    '8xy6': 'SHR V{x}, V{y}',
+    '8xy7': 'SUBN V{x}, V{y}',
+    '8xyE': 'SHL V{x}, V{y}',
+    '9xy0': 'SNE V{x}, V{y}',
+    'Annn': 'LD I, {nnn}',
+    'Bnnn': 'JP V0, {nnn}',
+    'Cxkk': 'RND V{x}, {kk}',
+    'Dxyn': 'DRW V{x}, V{y}, {n}',
+    'Dxy0': 'DRW V{x}, V{y}, 0',
+    'Ex9E': 'SKP V{x}',
+    'ExA1': 'SKNP V{x}',
+    'Fx07': 'LD V{x}, DT',
+    'Fx0A': 'LD V{x}, K',
+    'Fx15': 'LD DT, V{x}',
+    'Fx18': 'LD ST, V{x}',
+    'Fx1E': 'ADD I, V{x}',
+    'Fx29': 'LD F, V{x}',
+    'Fx30': 'LD HF, V{x}',
+    'Fx33': 'LD B, V{x}',
+    'Fx55': 'LD [I], V{x}',
+    'Fx65': 'LD V{x}, [I]',
+}
+
+# Registers that can be watched, besides v0 ... vF
+REGISTER_NAMES = ('pc', 'index', 'sp', 'delay', 'sound')
+
+# Assembly names of registers
+REGISTER_ALIASES = {'i': 'index', 'dt': 'delay', 'st': 'sound'}
+
+# Instructions run between checks for a pending key wait
+CHUNK = 1024
+
+
+# Assembly text of opcode
+def disassemble_opcode(opcode):
+    mnemonic = MNEMONICS.get(opcode_class(opcode))
+    if mnemonic is None:
+        return 'DW #%04X' % opcode
+
+    return mnemonic.format(
+        x='%X' % ((opcode & 0x0F00) >> 8),
+        y='%X' % ((opcode & 0x00F0) >> 4),
+        n=opcode & 0x000F,
+        kk='#%02X' % (opcode & 0x00FF),
+        nnn='#%03X' % (opcode & 0x0FFF),
+    )
+
+
+# (address, opcode, text) of count instructions starting at address
+def disassemble(memory, address, count=10):
+    lines = []
+    end = min(address + 2 * count, len(memory) - 1)
+    for address in range(address, end, 2):
+        opcode = (memory[address] << 8) | memory[address + 1]
+        lines.append((address, opcode, disassemble_opcode(opcode)))
+
+    return lines
+
+
+# Lower case name of a register, with aliases resolved
+def register_name(name):
+    name = name.lower()
+    return REGISTER_ALIASES.get(name, name)
+
+
+# Whether name looks like a register rather than an address
+def is_register(name):
+    name = register_name(name)
+    return name in REGISTER_NAMES or name[:1] == 'v'
+
+
+# Reads register name ('v0' ... 'vF', 'pc', 'index' or 'i', ...) of a CPU
+def register_reader(name):
+    name = register_name(name)
+    if len(name) == 2 and name[0] == 'v':
+        index = int(name[1], 16)
+        return lambda registers: registers.v[index]
+
+    if name not in REGISTER_NAMES:
+        raise ValueError('Unknown register: %s' % name)
+
+    return lambda registers: getattr(registers, name)
+
+
+# Why the debugger stopped: kind ('breakpoint', 'watch', 'step',
+# 'return', 'cycles', 'key_wait', 'interrupt') and the address it stopped
+# at. Raised from the CPU hooks to leave the run loop before the
+# instruction runs.
+class Break(Exception):
+    def __init__(self, kind, address, detail=None):
+        super(Break, self).__init__(kind, address, detail)
+        self.kind = kind
+        self.address = address
+        self.detail = detail
+
+    def __str__(self):
+        text = '%s at %s' % (self.kind, hex(self.address))
+        return text + (' (%s)' % self.detail if self.detail else '')
+
+
+# Breakpoints, watchpoints and stepping for a Chip8CPU
+# Checks are CPU hooks that are only attached while something is armed,
+# so with no breakpoint or watchpoint set the CPU runs its plain
+# execute_instruction. A breakpoint check is one set lookup on PC.
+# Register watchpoints compare the watched values before every
+# instruction; memory watchpoints see every write_memory call. Both stop
+# right after the instruction that changed the value.
+class Debugger(object):
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.breakpoints = set()
+        self.memory_watches = set()
+        self.register_watches = {}
+        self.pending = None
+        self.resuming = False
+        self.hooked = False
+
+    # Attach or detach the checks to match what is armed
+    def arm(self):
+        armed = bool(self.breakpoints or self.register_watches or
+                     self.memory_watches)
+        if armed and not self.hooked:
+            self.cpu.add_hook(self.check)
+            self.hooked = True
+        elif not armed and self.hooked:
+            self.cpu.remove_hook(self.check)
+            self.hooked = False
+
+        if self.memory_watches:
+            self.cpu.write_memory = self.write_memory
+        elif 'write_memory' in self.cpu.__dict__:
+            del self.cpu.write_memory
+
+    def detach(self):
+        self.breakpoints.clear()
+        self.memory_watches.clear()
+        self.register_watches.clear()
+        self.arm()
+
+    def add_breakpoint(self, address):
+        self.breakpoints.add(address)
+        self.arm()
+
+    def remove_breakpoint(self, address):
+        self.breakpoints.discard(address)
+        self.arm()
+
+    # Watch writes to memory addresses [address, end)
+    def watch_memory(self, address, end=None):
+        self.memory_watches.update(range(address, end or address + 1))
+        self.arm()
+
+    def unwatch_memory(self, address, end=None):
+        self.memory_watches.difference_update(
+            range(address, end or address + 1))
+        self.arm()
+
+    def watch_register(self, name):
+        reader = register_reader(name)
+        self.register_watches[register_name(name)] = [
+            reader, reader(self.cpu.registers)]
+        self.arm()
+
+    def unwatch_register(self, name):
+        self.register_watches.pop(register_name(name), None)
+        self.arm()
+
+    # Hook called before every instruction while armed
+    def check(self, cpu):
+        registers = cpu.registers
+        pc = registers.pc
+
+        if self.resuming:
+            self.resuming = False
+        elif pc in self.breakpoints:
+            raise Break('breakpoint', pc)
+
+        if self.pending:
+            pending, self.pending = self.pending, None
+            raise Break('watch', pc, pending)
+
+        for name, watch in self.register_watches.items():
+            value = watch[0](registers)
+            if value != watch[1]:
+                previous, watch[1] = watch[1], value
+                raise Break('watch', pc, '%s %s -> %s' % (
+                    name, hex(previous), hex(value)))
+
+    # Replacement for Chip8CPU.write_memory while memory is watched
+    def write_memory(self, address, data):
+        cpu = self.cpu
+        type(cpu).write_memory(cpu, address, data)
+
+        for offset in range(len(data)):
+            if address + offset in self.memory_watches:
+                self.pending = 'memory %s = %s' % (
+                    hex(address + offset), hex(data[offset]))
+                break
+
+    # Run until something armed triggers, the CPU waits for a key or
+    # cycles instructions ran. Returns the Break that stopped it.
+    def cont(self, cycles=None):
+        cpu = self.cpu
+        self.resuming = True
+        executed = 0
+
+        try:
+            while cycles is None or executed < cycles:
+                if cpu.key_wait is not None:
+                    return Break('key_wait', cpu.registers.pc)
+
+                chunk = CHUNK if cycles is None else min(CHUNK,
+                                                         cycles - executed)
+                for _ in range(chunk):
+                    cpu.execute_instruction()
+                executed += chunk
+        except Break as stop:
+            return stop
+        except KeyboardInterrupt:
+            return Break('interrupt', cpu.registers.pc)
+        finally:
+            self.resuming = False
+
+        return Break('cycles', cpu.registers.pc, executed)
+
+    # Execute one instruction, ignoring breakpoints
+    def step(self):
+        cpu = self.cpu
+        self.resuming = True
+        try:
+            cpu.execute_instruction()
+        except Break as stop:
+            return stop
+        finally:
+            self.resuming = False
+
+        if self.hooked:
+            # Watch hits are reported right away rather than before the
+            # next instruction
+            try:
+                self.check(cpu)
+            except Break as stop:
+                return stop
+
+        return Break('step', cpu.registers.pc)
+
+    # Step, running a 2nnn call until it returns
+    def step_over(self, cycles=None):
+        cpu = self.cpu
+        registers = cpu.registers
+        pc = registers.pc
+        opcode = (cpu.memory[pc] << 8) | cpu.memory[pc + 1]
+        if opcode & 0xF000 != 0x2000:
+            return self.step()
+
+        sp = registers.sp
+
+        def returned(cpu):
+            if registers.pc == pc + 2 and registers.sp == sp:
+                raise Break('return', pc + 2)
+
+        stop = self.step()
+        if stop.kind != 'step':
+            return stop
+
+        cpu.add_hook(returned)
+        try:
+            return self.cont(cycles)
+        finally:
+            cpu.remove_hook(returned)
+
+    # Listing around address, PC by default
+    def disassemble(self, address=None, count=10):
+        if address is None:
+            address = max(self.cpu.registers.pc - count // 2 * 2, 0)
+
+        return disassemble(self.cpu.memory, address, count)
+
+
+# Command line front end
+class DebuggerShell(cmd.Cmd):
+    prompt = '(chip8) '
+
+    def __init__(self, debugger):
+        super(DebuggerShell, self).__init__()
+        self.debugger = debugger
+
+    # A mistyped address or register, or a CPU fault, is reported without
+    # leaving the shell
+    def onecmd(self, line):
+        try:
+            return super(DebuggerShell, self).onecmd(line)
+        except (ValueError, IndexError) as error:
+            print('*** %s' % error)
+
+    def show(self, stop=None):
+        if stop is not None:
+            print(stop)
+        self.do_list('')
+
+    def do_break(self, arg):
+        'break ADDR: stop when PC reaches ADDR (hex)'
+        self.debugger.add_breakpoint(int(arg, 16))
+
+    def do_delete(self, arg):
+        'delete ADDR: remove the breakpoint at ADDR (hex)'
+        self.debugger.remove_breakpoint(int(arg, 16))
+
+    def do_watch(self, arg):
+        'watch REGISTER | ADDR [END]: stop when a register or memory changes'
+        args = arg.split()
+        if not args:
+            raise ValueError('watch needs a register or an address')
+
+        if is_register(args[0]):
+            self.debugger.watch_register(args[0])
+        else:
+            self.debugger.watch_memory(*[int(value, 16) for value in args])
+
+    def do_step(self, arg):
+        'step: execute one instruction'
+        self.show(self.debugger.step())
+
+    def do_next(self, arg):
+        'next: step, running over subroutine calls'
+        self.show(self.debugger.step_over())
+
+    def do_continue(self, arg):
+        'continue [CYCLES]: run until something stops the CPU'
+        self.show(self.debugger.cont(int(arg) if arg else None))
+
+    def do_list(self, arg):
+        'list [ADDR]: disassemble around PC or from ADDR (hex)'
+        pc = self.debugger.cpu.registers.pc
+        for address, opcode, text in self.debugger.disassemble(
+                int(arg, 16) if arg else None):
+            marker = '>' if address == pc else ' '
+            print('%s %03X  %04X  %s' % (marker, address, opcode, text))
+
+    def do_registers(self, arg):
+        'registers: show the registers'
+        registers = self.debugger.cpu.registers
+        print(' '.join('V%X=%02X' % (index, value)
+                       for index, value in enumerate(registers.v)))
+        print('PC=%03X I=%03X SP=%X DT=%02X ST=%02X' % (
+            registers.pc, registers.index, registers.sp, registers.delay,
+            registers.sound))
+
+    def do_quit(self, arg):
+        'quit: leave the debugger'
+        return True
+
+    do_b = do_break
+    do_w = do_watch
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_l = do_list
+    do_r = do_registers
+    do_q = do_quit
+
+
+if __name__ == "__main__":
+    from cpu import Chip8CPU
+    from screen import HeadlessScreen
+
+    parser = argparse.ArgumentParser(description='Debug a Chip8 ROM')
+    parser.add_argument('rom')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    cpu = Chip8CPU(HeadlessScreen(args.rom), args.seed)
+    cpu.load_rom(args.rom)
+
+    shell = DebuggerShell(Debugger(cpu))
+    shell.do_list('')
+    shell.cmdloop()
@@ -0,0 +1,433 @@
+import sys
+import time
+import zlib
+import struct
+import argparse
+from array import array
+from random import Random
+from cpu import Chip8CPU
+from screen import HeadlessScreen
+from quirks import QUIRK_PROFILES
+
+# Registers as hashed: V0 ... VF, I, PC, SP, delay and sound timers,
+# register waiting for a key (-1 when none), crashed flag, then the stack
+REGISTER_NAMES = ['V%X' % index for index in range(16)] + [
+    'I', 'PC', 'SP', 'DT', 'ST', 'key_wait', 'crashed'] + [
+    'stack[%d]' % index for index in range(16)]
+REGISTER_FORMAT = struct.Struct('<16BIIiBBb?16H')
+PC = REGISTER_NAMES.index('PC')
+
+# Memory is hashed in pages, only the pages written since the last hash
+# are hashed again
+PAGE_SIZE = 256
+
+# Instructions between timer ticks, 480 Hz at 60 frames per second
+CYCLES_PER_FRAME = 8
+
+
+# CRC of a memory buffer, kept per page
+# Writes mark their pages dirty (mark() is a Chip8CPU write listener), so
+# a digest only hashes what changed since the previous one.
+class PageHash(object):
+    def __init__(self, memory, page_size=PAGE_SIZE):
+        self.memory = memory
+        self.page_size = page_size
+        self.crcs = array('I', bytes(4 * (len(memory) // page_size)))
+        self.dirty = set(range(len(self.crcs)))
+
+    def mark(self, start, end):
+        if end > start:
+            self.dirty.update(range(start // self.page_size,
+                                    (end - 1) // self.page_size + 1))
+
+    def mark_all(self):
+        self.dirty.update(range(len(self.crcs)))
+
+    def digest(self):
+        memory = self.memory
+        size = self.page_size
+        for page in self.dirty:
+            self.crcs[page] = zlib.crc32(memory[page * size:(page + 1) * size])
+
+        self.dirty.clear()
+        return zlib.crc32(self.crcs)
+
+
+# Engines
+# An engine runs one machine and exposes its state to the harness. run()
+# executes at least cycles instructions and returns how many ran; exact
+# engines run exactly cycles, others (the JIT) stop at the end of their
+# blocks. A machine that raises is flagged crashed and stops executing,
+# its remaining cycles counting as run.
+
+# Instructions the reference may run past a crash of the candidate, the
+# candidate's count being lost when a whole block raises
+CRASH_WINDOW = 64
+
+
+# Chip8CPU, one instruction at a time
+class InterpreterEngine(object):
+    exact = True
+
+    def __init__(self, filename, seed=0, quirks=None):
+        self.cpu = Chip8CPU(HeadlessScreen(filename), seed, quirks)
+        self.cpu.load_rom(filename)
+        self.crashed = False
+
+        self.memory_hash = PageHash(self.cpu.memory)
+        self.cpu.write_listeners.append(self.memory_hash.mark)
+        self.framebuffer_crc = None
+
+    def run(self, cycles):
+        if not self.crashed:
+            execute_instruction = self.cpu.execute_instruction
+            try:
+                for _ in range(cycles):
+                    execute_instruction()
+            except Exception:
+                self.crashed = True
+
+        return cycles
+
+    def tick(self):
+        self.cpu.tick_timers()
+
+    def press(self, key):
+        self.cpu.keypad.press(key)
+
+    def release(self, key):
+        self.cpu.keypad.release(key)
+
+    def registers(self):
+        cpu = self.cpu
+        registers = cpu.registers
+        return (tuple(registers.v) + (
+            registers.index, registers.pc, registers.sp, registers.delay,
+            registers.sound, -1 if cpu.key_wait is None else cpu.key_wait,
+            self.crashed) + tuple(cpu.stack))
+
+    def memory(self):
+        return bytes(self.cpu.memory)
+
+    def framebuffer(self):
+        return self.cpu.screen.to_bytes()
+
+    # (registers, memory, framebuffer) hashes
+    def digest(self):
+        screen = self.cpu.screen
+        if screen.dirty or self.framebuffer_crc is None:
+            self.framebuffer_crc = zlib.crc32(screen.to_bytes())
+            screen.dirty = False
+
+        return (zlib.crc32(REGISTER_FORMAT.pack(*self.registers())),
+                self.memory_hash.digest(), self.framebuffer_crc)
+
+
+# BlockJIT on top of a Chip8CPU
+class JITEngine(InterpreterEngine):
+    exact = False
+
+    def __init__(self, filename, seed=0, quirks=None):
+        from jit import BlockJIT
+
+        super(JITEngine, self).__init__(filename, seed, quirks)
+        self.jit = BlockJIT(self.cpu)
+
+    def run(self, cycles):
+        if self.crashed:
+            return cycles
+
+        try:
+            return self.jit.run(cycles)
+        except Exception:
+            self.crashed = True
+            return cycles
+
+
+# One VectorChip8 instance
+# Cxkk draws from a Random seeded as Chip8CPU does, so both produce the
+# same numbers. The vector display only has the low resolution.
+class VectorEngine(object):
+    exact = True
+
+    def __init__(self, filename, seed=0, quirks=None):
+        from vector import VectorChip8
+
+        self.vector = VectorChip8(1, quirks=quirks)
+        self.vector.load_rom(filename)
+        self.vector.operations[0xC] = self.rand_vx
+        self.random = Random(seed)
+        self.memory_hash = PageHash(self.vector.memory[0])
+
+    def rand_vx(self, rows, opcode):
+        for row, x, kk in zip(rows, (opcode >> 8) & 0xF, opcode & 0xFF):
+            self.vector.v[row, x] = self.random.randint(0, 255) & kk
+
+    # Instructions of an instance waiting for a key count as run, as
+    # Chip8CPU keeps executing Fx0A
+    @property
+    def crashed(self):
+        return bool(self.vector.crashed[0])
+
+    def run(self, cycles):
+        step = self.vector.step
+        for _ in range(cycles):
+            step()
+
+        return cycles
+
+    def tick(self):
+        self.vector.tick_timers()
+
+    def press(self, key):
+        self.vector.press(key)
+
+    def release(self, key):
+        self.vector.release(key)
+
+    def registers(self):
+        vector = self.vector
+        return (tuple(int(value) for value in vector.v[0]) + (
+            int(vector.index[0]), int(vector.pc[0]), int(vector.sp[0]),
+            int(vector.delay[0]), int(vector.sound[0]),
+            int(vector.key_wait[0]), bool(vector.crashed[0])) +
+            tuple(int(value) for value in vector.stack[0]))
+
+    def memory(self):
+        return self.vector.memory[0].tobytes()
+
+    def framebuffer(self):
+        return self.vector.display[0].astype('>u8').tobytes()
+
+    def digest(self):
+        self.memory_hash.mark_all()
+        return (zlib.crc32(REGISTER_FORMAT.pack(*self.registers())),
+                self.memory_hash.digest(), zlib.crc32(self.framebuffer()))
+
+
+ENGINES = {
+    'interpreter': InterpreterEngine,
+    'jit': JITEngine,
+    'vector': VectorEngine,
+}
+
+
+# Pseudo-random (frame, key, pressed) events, as ScriptedInput replays:
+# a key pressed every interval frames and released a few frames later
+def random_key_events(seed, frames, interval=30):
+    random = Random(seed)
+    events = []
+    for frame in range(interval, frames, interval):
+        key = random.randrange(16)
+        events.append((frame, key, True))
+        events.append((frame + random.randint(1, interval - 1), key, False))
+
+    return sorted(events)
+
+
+# Differences between the state of two engines, as text
+def describe_differences(reference, candidate):
+    differences = []
+
+    for name, expected, actual in zip(REGISTER_NAMES, reference.registers(),
+                                      candidate.registers()):
+        if expected != actual:
+            differences.append('%s %s != %s' % (name, expected, actual))
+
+    expected = reference.memory()
+    actual = candidate.memory()
+    addresses = [address for address in range(len(expected))
+                 if expected[address] != actual[address]]
+    if addresses:
+        differences.append('memory[%s] %#04x != %#04x (%d bytes differ)' % (
+            hex(addresses[0]), expected[addresses[0]], actual[addresses[0]],
+            len(addresses)))
+
+    if reference.framebuffer() != candidate.framebuffer():
+        differences.append('framebuffer differs')
+
+    return differences
+
+
+# First point where two engines disagree
+# count is the number of instructions both ran identically; the
+# instruction at pc (opcode) is where the candidate went wrong. An engine
+# that is not exact is compared at the end of its blocks, so the faulty
+# instruction is one of the length instructions from pc.
+class Divergence(object):
+    def __init__(self, count, pc, opcode, length, differences):
+        self.count = count
+        self.pc = pc
+        self.opcode = opcode
+        self.length = length
+        self.differences = differences
+
+    def __str__(self):
+        from debugger import disassemble_opcode
+
+        text = 'diverged after %d instructions at %s (%04X %s)' % (
+            self.count, hex(self.pc), self.opcode,
+            disassemble_opcode(self.opcode))
+        if self.length > 1:
+            text += ', within %d instructions' % self.length
+
+        return text + ': ' + ', '.join(self.differences)
+
+
+# Runs a candidate engine against an exact reference engine over the same
+# ROM, seed and key events, comparing their state hashes every interval
+# instructions. Timers tick every cycles_per_frame instructions and key
+# events apply at frame boundaries, at the first point where both engines
+# stopped past them, so the run is identical however often the engines
+# are compared. On a mismatch, both engines are replayed up to the last
+# matching comparison and compared after every step from there.
+class Harness(object):
+    def __init__(self, filename, reference='interpreter', candidate='jit',
+                 seed=0, quirks=None, events=(), interval=1000,
+                 cycles_per_frame=CYCLES_PER_FRAME):
+        if not ENGINES[reference].exact:
+            raise ValueError('The reference engine must be exact: %s' %
+                             reference)
+
+        self.filename = filename
+        self.engine_names = (reference, candidate)
+        self.seed = seed
+        self.quirks = quirks
+        self.events = sorted(events)
+        self.interval = interval
+        self.cycles_per_frame = cycles_per_frame
+        self.start()
+
+    # Fresh engines, at instruction 0
+    def start(self):
+        self.reference, self.candidate = [
+            ENGINES[name](self.filename, self.seed, self.quirks)
+            for name in self.engine_names]
+        self.count = 0
+        self.frames = 0
+        self.position = 0
+
+    # Run the candidate up to target, or past it, then the reference up to
+    # the same count, and apply the timer ticks and key events that are due
+    def advance(self, target):
+        reference = self.reference
+        executed = self.candidate.run(target - self.count)
+        reference.run(executed)
+        self.count += executed
+
+        if self.candidate.crashed and not reference.crashed:
+            for _ in range(CRASH_WINDOW):
+                reference.run(1)
+                self.count += 1
+                if reference.crashed:
+                    break
+
+        events = self.events
+        while (self.frames + 1) * self.cycles_per_frame <= self.count:
+            self.reference.tick()
+            self.candidate.tick()
+            self.frames += 1
+
+            while (self.position < len(events) and
+                   events[self.position][0] <= self.frames):
+                _, key, pressed = events[self.position]
+                for engine in (self.reference, self.candidate):
+                    if pressed:
+                        engine.press(key)
+                    else:
+                        engine.release(key)
+
+                self.position += 1
+
+    def next_target(self, limit):
+        return min(limit, (self.frames + 1) * self.cycles_per_frame)
+
+    # Whether both engines crashed, their states are not compared anymore
+    def stopped(self):
+        return self.reference.crashed and self.candidate.crashed
+
+    # Run cycles instructions, returning the first Divergence or None
+    def run(self, cycles):
+        checked = 0
+        while self.count < cycles:
+            checkpoint = min(checked + self.interval, cycles)
+            while self.count < checkpoint:
+                self.advance(self.next_target(checkpoint))
+
+            if self.stopped():
+                break
+
+            if self.reference.digest() != self.candidate.digest():
+                return self.locate(checked)
+
+            checked = self.count
+
+        return None
+
+    # Replay to count, the last matching comparison, then compare after
+    # every step until the engines disagree
+    def locate(self, count):
+        self.start()
+        while self.count < count:
+            self.advance(self.next_target(count))
+
+        while True:
+            start = self.count
+            pc = self.reference.registers()[PC]
+            memory = self.reference.memory()
+            opcode = (memory[pc] << 8) | memory[pc + 1] \
+                if pc + 1 < len(memory) else 0
+
+            self.advance(start + 1)
+            if self.stopped():
+                return None
+
+            if self.reference.digest() != self.candidate.digest():
+                return Divergence(start, pc, opcode, self.count - start,
+                                  describe_differences(self.reference,
+                                                       self.candidate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run two Chip8 engines side by side and report where '
+                    'they diverge')
+    parser.add_argument('roms', nargs='+')
+    parser.add_argument('--reference', choices=sorted(ENGINES),
+                        default='interpreter')
+    parser.add_argument('--candidate', choices=sorted(ENGINES),
+                        default='jit')
+    parser.add_argument('--cycles', type=int, default=1000000,
+                        help='instructions to run per ROM')
+    parser.add_argument('--interval', type=int, default=1000,
+                        help='instructions between state comparisons')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quirks', choices=sorted(QUIRK_PROFILES),
+                        default=None)
+    parser.add_argument('--key-interval', type=int, default=30,
+                        help='frames between random key presses, 0 for none')
+    args = parser.parse_args()
+
+    diverged = False
+    for rom in args.roms:
+        events = random_key_events(
+            args.seed, args.cycles // CYCLES_PER_FRAME + 1,
+            args.key_interval) if args.key_interval else ()
+        harness = Harness(rom, args.reference, args.candidate, args.seed,
+                          args.quirks, events, args.interval)
+
+        start = time.perf_counter()
+        divergence = harness.run(args.cycles)
+        elapsed = time.perf_counter() - start
+
+        if divergence:
+            diverged = True
+            print('%-20s %s' % (rom, divergence))
+        elif harness.stopped():
+            print('%-20s both engines crashed after %d instructions' % (
+                rom, harness.count))
+        else:
+            print('%-20s %d instructions match (%d instructions/s)' % (
+                rom, harness.count, harness.count / elapsed))
+
+    sys.exit(1 if diverged else 0)
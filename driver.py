@@ -0,0 +1,266 @@
+import time
+import asyncio
+import inspect
+import argparse
+from scheduler import Scheduler
+from keypad import QueueInput
+
+
+# End of stream marker
+CLOSED = object()
+
+
+# Fan-out of items to any number of async subscribers
+# Every subscriber has its own bounded queue; when it is full the oldest
+# item is dropped, so publishing never waits on a slow subscriber.
+class Broadcast(object):
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.queues = []
+
+    def publish(self, item):
+        for queue in self.queues:
+            if queue.qsize() >= self.maxsize:
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+    # End every subscription after the items already queued
+    def close(self):
+        for queue in self.queues:
+            queue.put_nowait(CLOSED)
+
+    # Async iterator over the items published from now on
+    def subscribe(self):
+        queue = asyncio.Queue()
+        self.queues.append(queue)
+        return self.drain(queue)
+
+    async def drain(self, queue):
+        try:
+            while True:
+                item = await queue.get()
+                if item is CLOSED:
+                    break
+                yield item
+        finally:
+            self.queues.remove(queue)
+
+
+# Frontends
+# A frontend receives (frame number, packed framebuffer) through
+# present(), which may be a coroutine. Each one runs in its own task and
+# only ever sees the latest frame, so a slow frontend skips frames rather
+# than holding the CPU back.
+
+# Shows frames on a screen, e.g. the curses Screen or a HeadlessScreen
+class ScreenFrontend(object):
+    def __init__(self, screen):
+        self.screen = screen
+
+    def present(self, frame):
+        self.screen.from_bytes(frame[1])
+        self.screen.update()
+
+
+# Keeps the latest frame, for services that render on demand
+class HeadlessFrontend(object):
+    def __init__(self):
+        self.frame = None
+        self.presented = 0
+
+    def present(self, frame):
+        self.frame = frame
+        self.presented += 1
+
+
+# Hands frames over to another consumer through an asyncio queue
+# The queue holds at most maxsize frames, the oldest being dropped.
+class QueueFrontend(object):
+    def __init__(self, maxsize=1):
+        self.queue = asyncio.Queue(maxsize)
+
+    def present(self, frame):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(frame)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+# Runs a Chip8CPU inside an asyncio event loop
+# Every frame is emulated synchronously by a Scheduler, then the driver
+# yields to the loop until the next frame is due, so many sessions can
+# share one process. Timer ticks and frames are published on the ticks
+# and frames broadcasts; key events are queued with press(), release() or
+# feed() and applied at the next frame boundary. The CPU screen is meant
+# to be headless, frontends get copies of the framebuffer.
+class AsyncDriver(object):
+    def __init__(self, cpu, cpu_hz=500, frame_hz=60, max_frame_skip=5,
+                 execute=None, input_device=None):
+        self.cpu = cpu
+        self.input = QueueInput(cpu.keypad)
+        self.scheduler = Scheduler(cpu, cpu.screen, cpu_hz, frame_hz,
+                                   max_frame_skip, execute,
+                                   input_device or self.input)
+
+        self.ticks = Broadcast(maxsize=64)
+        self.frames = Broadcast(maxsize=1)
+        self.tasks = []
+        self.running = False
+
+    def press(self, key):
+        self.input.queue.append((key, True))
+
+    def release(self, key):
+        self.input.queue.append((key, False))
+
+    # Queue the (key, pressed) events of an async iterable as they come
+    async def feed(self, events):
+        async for key, pressed in events:
+            self.input.queue.append((key, pressed))
+
+    # Present frames on frontend from a task of its own
+    def attach(self, frontend):
+        task = asyncio.ensure_future(
+            self.present(frontend, self.frames.subscribe()))
+        self.tasks.append(task)
+        return task
+
+    async def present(self, frontend, frames):
+        async for frame in frames:
+            result = frontend.present(frame)
+            if inspect.isawaitable(result):
+                await result
+
+    def publish_frame(self):
+        screen = self.cpu.screen
+        for listener in self.scheduler.frame_listeners:
+            listener()
+
+        screen.dirty = False
+        self.frames.publish((self.scheduler.frames, screen.to_bytes()))
+
+    # Emulate one frame and tick the timers
+    # In unlimited mode the frame runs in chunks up to its deadline, the
+    # loop getting control back after every chunk, so concurrent sessions
+    # share the time instead of the first one filling every frame.
+    async def advance(self, deadline):
+        scheduler = self.scheduler
+        if scheduler.cycles_per_frame:
+            scheduler.advance(deadline)
+            return
+
+        cpu = self.cpu
+        clock = scheduler.clock
+        scheduler.input_device.poll()
+        while clock() < deadline and cpu.key_wait is None:
+            scheduler.instructions += scheduler.execute(scheduler.chunk)
+            await asyncio.sleep(0)
+
+        scheduler.tick()
+
+    # Run for the given number of frames, or until stop() is called
+    # Frontends attached to the driver get the last frame before their
+    # streams are closed.
+    async def run(self, frames=None):
+        scheduler = self.scheduler
+        clock = scheduler.clock
+        period = scheduler.frame_period
+        next_frame = clock()
+        count = 0
+        self.running = True
+
+        try:
+            self.publish_frame()
+            while self.running and (frames is None or count < frames):
+                deadline = next_frame + period
+                await self.advance(deadline)
+                self.ticks.publish(scheduler.frames)
+                if self.cpu.screen.dirty:
+                    self.publish_frame()
+                count += 1
+
+                next_frame = deadline
+                now = clock()
+                if now < next_frame:
+                    await asyncio.sleep(next_frame - now)
+                else:
+                    if now - next_frame > scheduler.max_frame_skip * period:
+                        next_frame = now
+                    await asyncio.sleep(0)
+        finally:
+            self.running = False
+            self.ticks.close()
+            self.frames.close()
+
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+            self.tasks = []
+
+    def stop(self):
+        self.running = False
+
+
+# Run sessions of the given ROMs concurrently, each with a headless
+# frontend, and return (driver, frontend) pairs
+async def run_sessions(roms, sessions=1, frames=600, cpu_hz=500):
+    from cpu import Chip8CPU
+    from screen import HeadlessScreen
+
+    pairs = []
+    for index in range(sessions):
+        filename = roms[index % len(roms)]
+        cpu = Chip8CPU(HeadlessScreen(filename))
+        cpu.load_rom(filename)
+
+        driver = AsyncDriver(cpu, cpu_hz)
+        frontend = HeadlessFrontend()
+        driver.attach(frontend)
+        pairs.append((driver, frontend))
+
+    await asyncio.gather(*(driver.run(frames) for driver, _ in pairs))
+    return pairs
+
+
+# Single curses session
+async def run_curses(filename, cpu_hz=500):
+    from cpu import Chip8CPU
+    from screen import Screen, HeadlessScreen
+    from keypad import CursesInput
+
+    screen = Screen(filename)
+    cpu = Chip8CPU(HeadlessScreen(filename))
+    cpu.load_rom(filename)
+
+    driver = AsyncDriver(cpu, cpu_hz, input_device=CursesInput(
+        screen.display_window, cpu.keypad))
+    driver.attach(ScreenFrontend(screen))
+    await driver.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run Chip8 sessions in an asyncio event loop')
+    parser.add_argument('roms', nargs='+')
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--frequency', type=int, default=500,
+                        help='CPU frequency in Hz, 0 runs unlimited')
+    parser.add_argument('--curses', action='store_true',
+                        help='show the first ROM in the terminal')
+    args = parser.parse_args()
+
+    if args.curses:
+        asyncio.run(run_curses(args.roms[0], args.frequency))
+    else:
+        start = time.perf_counter()
+        pairs = asyncio.run(run_sessions(args.roms, args.sessions,
+                                         args.frames, args.frequency))
+        elapsed = time.perf_counter() - start
+
+        for driver, frontend in pairs:
+            print('%-20s %6d frames %8d instructions %6d presented' % (
+                driver.cpu.screen.filename, driver.scheduler.frames,
+                driver.scheduler.instructions, frontend.presented))
+        print('%d sessions in %.3fs' % (len(pairs), elapsed))
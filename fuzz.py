@@ -0,0 +1,448 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+from random import Random
+from concurrent.futures import ProcessPoolExecutor
+from cpu import Chip8CPU, dispatch_table
+from screen import HeadlessScreen
+from quirks import QUIRK_PROFILES
+
+# Program length bounds, in instructions
+MIN_PROGRAM_LENGTH = 4
+MAX_PROGRAM_LENGTH = 128
+
+# 0nnn is ignored by the interpreter
+NOP = 0x0000
+
+# Instructions taking an address (1nnn, 2nnn, Annn, Bnnn), by most
+# significant nibble
+ADDRESS_OPERATIONS = (0x1, 0x2, 0xA, 0xB)
+
+# Appended to every program so it loops rather than running off into the
+# zeroed memory past it
+LOOP = 0x1200
+
+# Instructions between timer ticks (and key changes)
+CYCLES_PER_FRAME = 8
+
+# Handlers taking an address, retargeted into the program most of the time
+# so control flow stays in generated code
+ADDRESS_HANDLERS = {
+    'jump_to_location', 'call_subroutine', 'set_index',
+    'jump_to_location_plus_v0', 'jump_to_location_plus_vx',
+}
+
+# Handlers whose VF result is part of the coverage
+FLAG_HANDLERS = {
+    'add_vy_to_vx', 'subtract_vy_from_vx', 'subtract_vx_from_vy',
+    'shr_vx', 'shr_vy', 'shl_vx', 'shl_vy', 'draw_sprite',
+}
+
+# Branch taken, by PC change
+BRANCHES = {2: 'next', 4: 'skip', 0: 'stay'}
+
+
+# Handler name of every opcode for a quirk profile, 'not_implemented' for
+# opcodes without handler
+def handler_names(quirks=None):
+    return [entry[0].__name__ if entry else 'not_implemented'
+            for entry in dispatch_table(quirks)]
+
+
+# Opcodes of every handler name
+def opcodes_by_handler(names):
+    opcodes = {}
+    for opcode, name in enumerate(names):
+        opcodes.setdefault(name, []).append(opcode)
+
+    return opcodes
+
+
+def to_bytes(program):
+    return b''.join(opcode.to_bytes(2, 'big') for opcode in program)
+
+
+def from_bytes(data):
+    return [(data[offset] << 8) | data[offset + 1]
+            for offset in range(0, len(data) - 1, 2)]
+
+
+# Random programs and mutations of corpus programs
+# Handlers are picked with weights favouring those reached the least, then
+# an opcode of the handler is picked uniformly.
+class Generator(object):
+    def __init__(self, names, weights, random):
+        self.opcodes = opcodes_by_handler(names)
+        self.handlers = sorted(self.opcodes)
+        self.weights = [weights.get(name, 1.0) for name in self.handlers]
+        self.random = random
+
+    def instruction(self, length):
+        random = self.random
+        name = random.choices(self.handlers, self.weights)[0]
+        opcode = random.choice(self.opcodes[name])
+
+        if name in ADDRESS_HANDLERS and random.random() < 0.8:
+            target = 0x200 + 2 * random.randrange(length)
+            opcode = (opcode & 0xF000) | (target & 0x0FFF)
+            if name == 'jump_to_location_plus_vx':
+                opcode = (opcode & 0xFF00) | (target & 0x00FF)
+
+        return opcode
+
+    def program(self):
+        length = self.random.randint(MIN_PROGRAM_LENGTH, MAX_PROGRAM_LENGTH)
+        return [self.instruction(length) for _ in range(length)]
+
+    def mutate(self, program, corpus):
+        random = self.random
+        program = list(program)
+
+        for _ in range(random.randint(1, 4)):
+            length = len(program)
+            position = random.randrange(length)
+            mutation = random.randrange(6)
+
+            if mutation == 0:
+                program[position] = self.instruction(length)
+            elif mutation == 1 and length < MAX_PROGRAM_LENGTH:
+                program.insert(position, self.instruction(length + 1))
+            elif mutation == 2 and length > MIN_PROGRAM_LENGTH:
+                del program[position]
+            elif mutation == 3:
+                program[position] ^= 1 << random.randrange(16)
+            elif mutation == 4 and corpus:
+                other = random.choice(corpus)
+                program = (program[:position] +
+                           other[random.randrange(len(other)):])
+            else:
+                end = min(position + random.randint(1, 8), length)
+                program[position:position] = program[position:end]
+
+            program = program[:MAX_PROGRAM_LENGTH]
+
+        return program
+
+
+# Run program headless for cycles instructions
+# Returns the coverage features reached, (handler, branch, VF), and the
+# crash signature, (exception, handler), with its message, or None. The
+# program jumps back to its start when it runs past its end. Timers
+# tick every frame, when keys are also pressed and released at random;
+# the same seed gives the same run.
+def run_program(program, cycles, seed=0, quirks=None, names=None):
+    names = names or handler_names(quirks)
+    random = Random(seed)
+    cpu = Chip8CPU(HeadlessScreen(), seed, quirks)
+    cpu.write_memory(0x200, to_bytes(program + [LOOP]))
+
+    registers = cpu.registers
+    memory = cpu.memory
+    keypad = cpu.keypad
+    execute_instruction = cpu.execute_instruction
+    features = set()
+    pc = registers.pc
+
+    try:
+        for step in range(1, cycles + 1):
+            pc = registers.pc
+            execute_instruction()
+
+            name = names[cpu.operand]
+            branch = BRANCHES.get(registers.pc - pc, 'jump')
+            flag = registers.v[0xF] if name in FLAG_HANDLERS else None
+            features.add((name, branch, flag))
+
+            if step % CYCLES_PER_FRAME == 0:
+                cpu.tick_timers()
+                key = random.randrange(16)
+                if keypad.state[key]:
+                    keypad.release(key)
+                elif random.random() < 0.5:
+                    keypad.press(key)
+    except Exception as error:
+        if pc + 1 < len(memory):
+            handler = names[(memory[pc] << 8) | memory[pc + 1]]
+        else:
+            handler = 'fetch'
+
+        return features, ((type(error).__name__, handler),
+                          '%s at %s: %s' % (type(error).__name__, hex(pc),
+                                            error))
+
+    return features, None
+
+
+# Program without its instructions [start, end)
+# Addresses past the removed instructions move down with the code they
+# point to, and addresses into them point to the instruction that
+# followed them.
+def delete_instructions(program, start, end):
+    low = 0x200 + 2 * start
+    high = 0x200 + 2 * end
+    top = 0x200 + 2 * len(program)
+
+    result = []
+    for opcode in program[:start] + program[end:]:
+        if opcode >> 12 in ADDRESS_OPERATIONS:
+            address = opcode & 0x0FFF
+            if high <= address <= top:
+                opcode -= high - low
+            elif low <= address < high:
+                opcode = (opcode & 0xF000) | low
+        result.append(opcode)
+
+    return result
+
+
+# Smallest program found that still crashes with signature
+# Alternates two passes until neither changes the program: deleting ever
+# smaller runs of instructions, then replacing them with NOP, which keeps
+# the addresses of the code after them and lets the next deletion pass
+# drop what the crash does not need.
+def minimize(program, signature, cycles, seed=0, quirks=None, names=None):
+    names = names or handler_names(quirks)
+    program = list(program)
+
+    def crashes(candidate):
+        crash = run_program(candidate, cycles, seed, quirks, names)[1]
+        return crash is not None and crash[0] == signature
+
+    changed = True
+    while changed:
+        changed = False
+
+        chunk = max(len(program) // 2, 1)
+        while chunk >= 1:
+            start = 0
+            while start < len(program) and len(program) > 1:
+                end = min(start + chunk, len(program))
+                candidate = delete_instructions(program, start, end)
+                if candidate and crashes(candidate):
+                    program = candidate
+                    changed = True
+                else:
+                    start += chunk
+            chunk //= 2
+
+        chunk = max(len(program) // 2, 1)
+        while chunk >= 1:
+            for start in range(0, len(program), chunk):
+                end = min(start + chunk, len(program))
+                if all(opcode == NOP for opcode in program[start:end]):
+                    continue
+
+                candidate = program[:start] + [NOP] * (end - start) + \
+                    program[end:]
+                if crashes(candidate):
+                    program = candidate
+                    changed = True
+            chunk //= 2
+
+    return program
+
+
+# Fuzz count programs, half fresh and half mutated from corpus
+# Returns the programs that reached features outside known, with their
+# features, and every crash as (program, signature, message).
+def fuzz_batch(seed, count, cycles, corpus, known, weights, quirks=None):
+    random = Random(seed)
+    names = handler_names(quirks)
+    generator = Generator(names, weights, random)
+    known = set(known)
+    interesting = []
+    crashes = []
+    hits = {}
+
+    for index in range(count):
+        if corpus and random.random() < 0.5:
+            program = generator.mutate(random.choice(corpus), corpus)
+        else:
+            program = generator.program()
+
+        features, crash = run_program(program, cycles, seed + index, quirks,
+                                      names)
+        for name in set(feature[0] for feature in features):
+            hits[name] = hits.get(name, 0) + 1
+
+        if crash:
+            crashes.append((program, seed + index, crash[0], crash[1]))
+        elif not features <= known:
+            known |= features
+            interesting.append((program, sorted(features, key=repr)))
+
+    return interesting, crashes, hits
+
+
+# Coverage-guided fuzzing on a process pool
+# Every round hands each worker a batch of programs to generate, with the
+# corpus and coverage gathered so far. Programs reaching new features join
+# the corpus; crashes are deduplicated by signature, minimized and saved.
+class Fuzzer(object):
+    def __init__(self, output='crashes', corpus_directory=None, cycles=2000,
+                 quirks=None, seed=0):
+        self.output = output
+        self.corpus_directory = corpus_directory
+        self.cycles = cycles
+        self.quirks = quirks
+        self.seed = seed
+        self.names = handler_names(quirks)
+
+        self.corpus = []
+        self.features = set()
+        self.hits = {}
+        self.signatures = {}
+        self.programs = 0
+        self.crashes = 0
+
+        # Crashes saved by earlier runs are not saved again
+        index = os.path.join(output, 'crashes.jsonl')
+        if os.path.exists(index):
+            with open(index) as file:
+                for line in file:
+                    crash = json.loads(line)
+                    self.signatures[tuple(crash['signature'])] = crash['file']
+
+        if corpus_directory and os.path.isdir(corpus_directory):
+            for name in sorted(os.listdir(corpus_directory)):
+                with open(os.path.join(corpus_directory, name), 'rb') as file:
+                    self.add(from_bytes(file.read()), save=False)
+
+    # Add program to the corpus if it reaches new features
+    def add(self, program, features=None, save=True):
+        if features is None:
+            features = run_program(program, self.cycles, 0, self.quirks,
+                                   self.names)[0]
+
+        features = set(tuple(feature) for feature in features)
+        if features <= self.features:
+            return False
+
+        self.features |= features
+        self.corpus.append(program)
+
+        if save and self.corpus_directory:
+            os.makedirs(self.corpus_directory, exist_ok=True)
+            data = to_bytes(program)
+            path = os.path.join(self.corpus_directory, '%s.ch8' %
+                                hashlib.sha1(data).hexdigest())
+            with open(path, 'wb') as file:
+                file.write(data)
+
+        return True
+
+    # Handler weights, favouring handlers reached by few programs
+    def weights(self):
+        return {name: 1.0 / (1 + self.hits.get(name, 0)) ** 0.5
+                for name in set(self.names)}
+
+    def save_crash(self, program, seed, signature, message):
+        from debugger import disassemble_opcode
+
+        program = minimize(program, signature, self.cycles, seed,
+                           self.quirks, self.names)
+        message = run_program(program, self.cycles, seed, self.quirks,
+                              self.names)[1][1]
+        data = to_bytes(program)
+        name = '%s-%s-%s' % (signature[0], signature[1],
+                             hashlib.sha1(data).hexdigest()[:8])
+
+        os.makedirs(self.output, exist_ok=True)
+        with open(os.path.join(self.output, name + '.ch8'), 'wb') as file:
+            file.write(data)
+        with open(os.path.join(self.output, 'crashes.jsonl'), 'a') as file:
+            file.write(json.dumps({
+                'file': name + '.ch8',
+                'signature': signature,
+                'error': message,
+                'seed': seed,
+                'cycles': self.cycles,
+                'quirks': self.quirks,
+                'program': ['%04X %s' % (opcode, disassemble_opcode(opcode))
+                            for opcode in program],
+            }) + '\n')
+
+        return name
+
+    def merge(self, result):
+        interesting, crashes, hits = result
+        for program, features in interesting:
+            self.add(program, features)
+
+        for name, count in hits.items():
+            self.hits[name] = self.hits.get(name, 0) + count
+
+        for program, seed, signature, message in crashes:
+            self.crashes += 1
+            signature = tuple(signature)
+            if signature not in self.signatures:
+                self.signatures[signature] = self.save_crash(
+                    program, seed, signature, message)
+
+    # Run rounds of batch programs per worker, for at most duration
+    # seconds when given
+    def run(self, rounds=10, batch=200, workers=None, duration=None,
+            report=print):
+        workers = workers or os.cpu_count()
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for number in range(rounds):
+                weights = self.weights()
+                seed = self.seed + number * workers * batch
+                futures = [executor.submit(
+                    fuzz_batch, seed + worker * batch, batch, self.cycles,
+                    self.corpus, self.features, weights, self.quirks)
+                    for worker in range(workers)]
+
+                for future in futures:
+                    self.merge(future.result())
+                self.programs += batch * workers
+
+                elapsed = time.perf_counter() - start
+                report('round %d: %d programs, %d features, %d in corpus, '
+                       '%d crashes (%d unique), %d programs/s' % (
+                           number + 1, self.programs, len(self.features),
+                           len(self.corpus), self.crashes,
+                           len(self.signatures), self.programs / elapsed))
+
+                if duration is not None and elapsed > duration:
+                    break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Coverage-guided fuzzer for the Chip8 interpreter')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=200,
+                        help='programs per worker and round')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, defaults to all cores')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='stop after this many seconds')
+    parser.add_argument('--cycles', type=int, default=2000,
+                        help='instructions run per program')
+    parser.add_argument('--quirks', choices=sorted(QUIRK_PROFILES),
+                        default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='crashes',
+                        help='directory of the minimized crashing programs')
+    parser.add_argument('--corpus', default=None,
+                        help='corpus directory, loaded and kept between runs')
+    parser.add_argument('--replay', metavar='ROM',
+                        help='run a saved program and report its crash')
+    parser.add_argument('--replay-seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay, 'rb') as file:
+            program = from_bytes(file.read())
+        features, crash = run_program(program, args.cycles, args.replay_seed,
+                                      args.quirks)
+        print(crash[1] if crash else 'no crash, %d features' % len(features))
+    else:
+        fuzzer = Fuzzer(args.output, args.corpus, args.cycles, args.quirks,
+                        args.seed)
+        fuzzer.run(args.rounds, args.batch, args.workers, args.duration)
@@ -0,0 +1,366 @@
+from fonts import FONT_ADDRESS, BIG_FONT_ADDRESS
+
+
+MAX_BLOCK_LENGTH = 64
+
+
+# Code templates
+# Each template receives the decoded operands and returns the lines of
+# Python that reproduce the handler, with V registers held in locals
+# (v0 ... vF) and the index register in "index". Flags are assigned after
+# the result, as the handlers do.
+def emit_add(x, y):
+    return [
+        'result = v%X + v%X' % (x, y),
+        'v%X = result & 0xFF' % x,
+        'vF = result >> 8',
+    ]
+
+
+def emit_subtract(x, minuend, subtrahend):
+    return [
+        'result = v%X - v%X' % (minuend, subtrahend),
+        'v%X = result & 0xFF' % x,
+        'vF = 0 if result < 0 else 1',
+    ]
+
+
+def emit_shr(x, source):
+    return [
+        'value = v%X' % source,
+        'v%X = value >> 1' % x,
+        'vF = value & 1',
+    ]
+
+
+def emit_shl(x, source):
+    return [
+        'value = v%X' % source,
+        'v%X = (value << 1) & 0xFF' % x,
+        'vF = value >> 7',
+    ]
+
+
+def emit_logic(operator, reset_vf):
+    def emit(x, y):
+        lines = ['v%X = v%X %s v%X' % (x, x, operator, y)]
+        return lines + ['vF = 0'] if reset_vf else lines
+
+    return emit
+
+
+TEMPLATES = {
+    'set_register': lambda x, kk: ['v%X = %d' % (x, kk)],
+    'add_to_register': lambda x, kk: ['v%X = (v%X + %d) & 0xFF' % (x, x, kk)],
+    'load_vy_into_vx': lambda x, y: ['v%X = v%X' % (x, y)],
+    'load_or_vy_into_vx': emit_logic('|', False),
+    'load_and_vy_into_vx': emit_logic('&', False),
+    'load_xor_vy_into_vx': emit_logic('^', False),
+    'load_or_vy_into_vx_reset_vf': emit_logic('|', True),
+    'load_and_vy_into_vx_reset_vf': emit_logic('&', True),
+    'load_xor_vy_into_vx_reset_vf': emit_logic('^', True),
+    'add_vy_to_vx': emit_add,
+    'subtract_vy_from_vx': lambda x, y: emit_subtract(x, x, y),
+    'subtract_vx_from_vy': lambda x, y: emit_subtract(x, y, x),
+    'shr_vx': lambda x, y: emit_shr(x, x),
+    'shr_vy': lambda x, y: emit_shr(x, y),
+    'shl_vx': lambda x, y: emit_shl(x, x),
+    'shl_vy': lambda x, y: emit_shl(x, y),
+    'set_index': lambda nnn: ['index = %d' % nnn],
+    'add_vx_to_index': lambda x: ['index = (index + v%X) & 0xFFFF' % x],
+    'load_delay_timer_into_vx': lambda x: ['v%X = registers.delay' % x],
+    'set_delay_timer': lambda x: ['registers.delay = v%X' % x],
+    'set_sound_timer': lambda x: ['registers.sound = v%X' % x],
+    'set_index_to_font': lambda x: [
+        'index = %d + (v%X & 0xF) * 5' % (FONT_ADDRESS, x),
+    ],
+    'set_index_to_big_font': lambda x: [
+        'index = %d + (v%X & 0xF) * 10' % (BIG_FONT_ADDRESS, x),
+    ],
+}
+
+# Handlers without template that change PC; a call to them ends the block
+CALLED_TERMINATORS = {'wait_for_key'}
+
+# Handlers without template that write memory, possibly into the block
+# that called them
+MEMORY_WRITERS = {
+    'store_bcd', 'store_registers', 'store_registers_advance_index',
+    'store_registers_advance_index_by_x',
+}
+
+# Conditions of the skip instructions, "keys" being the keypad state
+SKIPS = {
+    'skip_if_equal': lambda x, kk: 'v%X == %d' % (x, kk),
+    'skip_if_not_equal': lambda x, kk: 'v%X != %d' % (x, kk),
+    'skip_if_registers_equal': lambda x, y: 'v%X == v%X' % (x, y),
+    'skip_if_registers_not_equal': lambda x, y: 'v%X != v%X' % (x, y),
+    'skip_if_key_pressed': lambda x: 'keys[v%X & 0xF]' % x,
+    'skip_if_key_not_pressed': lambda x: 'not keys[v%X & 0xF]' % x,
+}
+
+
+def emit_skip(condition):
+    def emit(next_pc, *operands):
+        return ['pc = %d if %s else %d' % (next_pc + 2, condition(*operands),
+                                           next_pc)]
+
+    return emit
+
+
+# Block terminators, given the operands and the address of the next
+# instruction. They only assign "pc" (and the stack).
+TERMINATORS = {
+    'jump_to_location': lambda next_pc, nnn: ['pc = %d' % nnn],
+    'jump_to_location_plus_v0': lambda next_pc, nnn: ['pc = %d + v0' % nnn],
+    'jump_to_location_plus_vx': lambda next_pc, nnn: [
+        'pc = %d + v%X' % (nnn, nnn >> 8),
+    ],
+    'call_subroutine': lambda next_pc, nnn: [
+        'sp = registers.sp + 1',
+        'registers.sp = sp',
+        'stack[sp] = %d' % next_pc,
+        'pc = %d' % nnn,
+    ],
+    'return_from_subroutine': lambda next_pc: [
+        'sp = registers.sp',
+        'if sp == 0:',
+        '    raise IndexError(\'Return with an empty stack\')',
+        'pc = stack[sp]',
+        'registers.sp = sp - 1',
+    ],
+}
+# A skip ends the block when the instruction it skips can not be inlined
+TERMINATORS.update((name, emit_skip(condition))
+                   for name, condition in SKIPS.items())
+
+REGISTER_NAMES = ['v%X' % index for index in range(16)]
+
+
+def indent(lines):
+    return ['    ' + line for line in lines]
+
+
+# Basic block compiler and execution engine
+# Straight-line runs of instructions are compiled once into Python
+# functions, ending at the first jump, call or return. A skip is inlined
+# as an "if" around the instruction it skips, which returns from the
+# block when that instruction is a jump. Operations with a template run
+# on locals; the others call the bound CPU handler, with the locals
+# written back before the call and read again after it.
+# Blocks run to completion, so run() may overshoot its cycle budget by up
+# to one block. A block that writes memory it was compiled from stops
+# right after the write.
+class BlockJIT(object):
+    def __init__(self, cpu, max_block_length=MAX_BLOCK_LENGTH):
+        self.cpu = cpu
+        self.max_block_length = max_block_length
+        self.blocks = [None] * len(cpu.memory)
+        self.block_ranges = {}
+        self.interpreted = bytearray(len(cpu.memory))
+
+        cpu.write_listeners.append(self.on_memory_write)
+
+    # Stop listening to CPU memory writes
+    def detach(self):
+        self.cpu.write_listeners.remove(self.on_memory_write)
+
+    # Drop the blocks overlapping a memory write
+    # Written addresses that were compiled, in a block that may be running,
+    # are self-modifying code and stay in the interpreter from now on;
+    # other writes (ROM loads, restores, data) only drop blocks.
+    def on_memory_write(self, start, end):
+        for block_start, block_end in list(self.block_ranges.items()):
+            if block_start < end and start < block_end:
+                if self.blocks[block_start] is not self.interpret:
+                    for address in range(max(start, block_start),
+                                         min(end, block_end)):
+                        self.interpreted[address] = 1
+
+                self.blocks[block_start] = None
+                del self.block_ranges[block_start]
+
+    # (name, operands, bound handler, address) of the instruction at
+    # address, None when it must be interpreted
+    def scan(self, address):
+        cpu = self.cpu
+        if address + 1 >= len(cpu.memory) or self.interpreted[address]:
+            return None
+
+        _, operation = cpu.decode_at(address)
+        name = getattr(operation, 'func', operation).__name__
+        return name, getattr(operation, 'args', ()), operation, address
+
+    # Decode the straight-line run of instructions starting at address
+    # Returns the instructions, the terminator (or None) and the address
+    # following the block. A skip is kept in the run along with the
+    # instruction it skips, unless that is a skip too.
+    def scan_block(self, address):
+        instructions = []
+        terminator = None
+
+        while len(instructions) < self.max_block_length:
+            instruction = self.scan(address)
+            if instruction is None:
+                break
+
+            name = instruction[0]
+            if name in SKIPS:
+                skipped = self.scan(address + 2)
+                if skipped is None or skipped[0] in SKIPS:
+                    terminator = instruction
+                    break
+
+                instructions.extend((instruction, skipped))
+                address += 4
+                continue
+
+            if name in TERMINATORS or name in CALLED_TERMINATORS:
+                terminator = instruction
+                break
+
+            instructions.append(instruction)
+            address += 2
+
+        return instructions, terminator, address
+
+    # Generate and compile the Python function for the block at address
+    def compile_block(self, address):
+        instructions, terminator, end = self.scan_block(address)
+        if terminator:
+            instructions.append(terminator)
+            end = terminator[3] + 2
+
+        count = len(instructions)
+        if count == 0:
+            self.blocks[address] = self.interpret
+            self.block_ranges[address] = address + 2
+            return self.interpret
+
+        # Locals are needed for every register a template touches
+        code = []
+        for name, operands, _, at in instructions:
+            if name in SKIPS:
+                code.append(SKIPS[name](*operands))
+            elif name in TEMPLATES:
+                code.extend(TEMPLATES[name](*operands))
+            elif name in TERMINATORS:
+                code.extend(TERMINATORS[name](at + 2, *operands))
+        code = '\n'.join(code)
+        used = [name for name in REGISTER_NAMES if name in code]
+        uses_index = 'index' in code
+        skips = any(name in SKIPS for name, _, _, _ in instructions[:-1])
+
+        def store():
+            lines = ['v[%d] = %s' % (int(name[1], 16), name)
+                     for name in used]
+            return lines + (['registers.index = index'] if uses_index else [])
+
+        def load():
+            lines = ['%s = v[%d]' % (name, int(name[1], 16))
+                     for name in used]
+            return lines + (['index = registers.index'] if uses_index else [])
+
+        def executed(count):
+            return '%d - skipped' % count if skips else '%d' % count
+
+        # Lines of one instruction, executed being the instruction count
+        # of the block up to and including it
+        def emit(instruction, executed_count):
+            name, operands, operation, at = instruction
+            if name in TEMPLATES:
+                return TEMPLATES[name](*operands)
+            if name in TERMINATORS:
+                return TERMINATORS[name](at + 2, *operands)
+
+            namespace['call_%X' % at] = operation
+            lines = store() + ['registers.pc = %d' % (at + 2),
+                               'call_%X()' % at] + load()
+            if name in CALLED_TERMINATORS:
+                lines.append('pc = registers.pc')
+            elif name in MEMORY_WRITERS and executed_count < count:
+                lines.extend([
+                    'if blocks[%d] is None:' % address,
+                    '    registers.pc = %d' % (at + 2),
+                    '    return %s' % executed(executed_count),
+                ])
+
+            return lines
+
+        def is_terminator(instruction):
+            return (instruction[0] in TERMINATORS or
+                    instruction[0] in CALLED_TERMINATORS)
+
+        namespace = {'blocks': self.blocks, 'keys': self.cpu.keypad.state}
+        body = ['skipped = 0'] if skips else []
+        position = 0
+        while position < count:
+            instruction = instructions[position]
+            name, operands = instruction[:2]
+            position += 1
+
+            if name in SKIPS and position < count:
+                skipped = instructions[position]
+                position += 1
+
+                lines = emit(skipped, position)
+                if is_terminator(skipped):
+                    lines += store() + ['registers.pc = pc',
+                                        'return %s' % executed(position)]
+                body.append('if %s:' % SKIPS[name](*operands))
+                body.append('    skipped += 1')
+                body.append('else:')
+                body.extend(indent(lines))
+            else:
+                body.extend(emit(instruction, position))
+
+        if terminator is None:
+            body.append('pc = %d' % end)
+
+        lines = ['def block(registers, stack):', '    v = registers.v']
+        lines.extend(indent(load()))
+        lines.extend(indent(body))
+        lines.extend(indent(store()))
+        lines.append('    registers.pc = pc')
+        lines.append('    return %s' % executed(count))
+
+        exec(compile('\n'.join(lines), '<block %s>' % hex(address), 'exec'),
+             namespace)
+
+        self.blocks[address] = namespace['block']
+        self.block_ranges[address] = end
+        return namespace['block']
+
+    # Fallback "block" for addresses that can not be compiled
+    def interpret(self, registers, stack):
+        self.cpu.execute_instruction()
+        return 1
+
+    # Execute one block, or one interpreted instruction, at the current PC
+    def step(self):
+        cpu = self.cpu
+        if cpu.hooks:
+            cpu.execute_instruction()
+            return 1
+
+        block = self.blocks[cpu.registers.pc]
+        if block is None:
+            block = self.compile_block(cpu.registers.pc)
+
+        return block(cpu.registers, cpu.stack)
+
+    # Run at least the given number of instructions
+    def run(self, cycles):
+        cpu = self.cpu
+        registers = cpu.registers
+        blocks = self.blocks
+        executed = 0
+
+        while executed < cycles:
+            block = blocks[registers.pc]
+            if block is None or cpu.hooks:
+                executed += self.step()
+            else:
+                executed += block(registers, cpu.stack)
+
+        return executed
@@ -0,0 +1,147 @@
+import json
+import time
+import base64
+import argparse
+from cpu import Chip8CPU
+from screen import HeadlessScreen
+
+
+# Event kinds
+TICK = 'tick'
+PRESS = 'press'
+RELEASE = 'release'
+
+
+# Everything needed to reproduce a run: the machine state, RNG seed and
+# quirk profile it started from, and the timer ticks and key events, each
+# stamped with the number of instructions executed before it.
+class Journal(object):
+    def __init__(self, seed, start, events=None, cycles=0, framebuffer=None,
+                 quirks=None):
+        self.seed = seed
+        self.start = start
+        self.events = events if events is not None else []
+        self.cycles = cycles
+        self.framebuffer = framebuffer
+        self.quirks = quirks
+
+    def to_dict(self):
+        return {
+            'seed': self.seed,
+            'start': base64.b64encode(self.start).decode('ascii'),
+            'events': self.events,
+            'cycles': self.cycles,
+            'framebuffer': (base64.b64encode(self.framebuffer).decode('ascii')
+                            if self.framebuffer is not None else None),
+            'quirks': self.quirks,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        framebuffer = data.get('framebuffer')
+        return cls(
+            data['seed'],
+            base64.b64decode(data['start']),
+            [tuple(event) for event in data['events']],
+            data['cycles'],
+            base64.b64decode(framebuffer) if framebuffer else None,
+            data.get('quirks'),
+        )
+
+    def save(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as file:
+            return cls.from_dict(json.load(file))
+
+
+# Records the run driven by a scheduler into a journal
+# Reseeds the CPU RNG, so the recording starts from a known state.
+class Recorder(object):
+    def __init__(self, scheduler, seed=None):
+        self.scheduler = scheduler
+        cpu = scheduler.cpu
+
+        if seed is None:
+            seed = int(time.time() * 1000)
+        cpu.random.seed(seed)
+
+        self.base = scheduler.instructions
+        self.journal = Journal(seed, cpu.snapshot(), quirks=cpu.quirks)
+
+        scheduler.tick_listeners.append(self.on_tick)
+        cpu.keypad.listeners.append(self.on_press)
+        cpu.keypad.release_listeners.append(self.on_release)
+
+    def cycle(self):
+        return self.scheduler.instructions - self.base
+
+    def on_tick(self):
+        self.journal.events.append((self.cycle(), TICK))
+
+    def on_press(self, key):
+        self.journal.events.append((self.cycle(), PRESS, key))
+
+    def on_release(self, key):
+        self.journal.events.append((self.cycle(), RELEASE, key))
+
+    # Stop recording, stamping the final state
+    def stop(self):
+        cpu = self.scheduler.cpu
+        self.scheduler.tick_listeners.remove(self.on_tick)
+        cpu.keypad.listeners.remove(self.on_press)
+        cpu.keypad.release_listeners.remove(self.on_release)
+
+        self.journal.cycles = self.cycle()
+        self.journal.framebuffer = cpu.screen.to_bytes()
+        return self.journal
+
+
+# Re-run a journal headless, as fast as possible
+# Returns the CPU and whether the final framebuffer is byte-identical to
+# the recorded one.
+def replay(journal, cpu=None):
+    if cpu is None:
+        cpu = Chip8CPU(HeadlessScreen(), quirks=journal.quirks)
+
+    cpu.restore(journal.start)
+    cpu.random.seed(journal.seed)
+    keypad = cpu.keypad
+    keypad.reset()
+
+    executed = 0
+    for event in journal.events + [(journal.cycles, None)]:
+        cycle, kind = event[0], event[1]
+
+        execute_instruction = cpu.execute_instruction
+        for _ in range(cycle - executed):
+            execute_instruction()
+        executed = cycle
+
+        if kind == TICK:
+            cpu.tick_timers()
+        elif kind == PRESS:
+            keypad.press(event[2])
+        elif kind == RELEASE:
+            keypad.release(event[2])
+
+    matches = (journal.framebuffer is None or
+               cpu.screen.to_bytes() == journal.framebuffer)
+    return cpu, matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a Chip8 journal')
+    parser.add_argument('journal')
+    args = parser.parse_args()
+
+    journal = Journal.load(args.journal)
+    start = time.perf_counter()
+    cpu, matches = replay(journal)
+    elapsed = time.perf_counter() - start
+
+    print('%d instructions replayed in %.3fs, framebuffer %s' % (
+        journal.cycles, elapsed, 'matches' if matches else 'differs'))
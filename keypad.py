@@ -0,0 +1,119 @@
+import curses
+from collections import deque
+
+
+# Host keys for the 16 Chip8 keys, laid out as the original keypad
+#   1 2 3 C      1 2 3 4
+#   4 5 6 D  ->  q w e r
+#   7 8 9 E      a s d f
+#   A 0 B F      z x c v
+KEY_MAP = {
+    '1': 0x1, '2': 0x2, '3': 0x3, '4': 0xC,
+    'q': 0x4, 'w': 0x5, 'e': 0x6, 'r': 0xD,
+    'a': 0x7, 's': 0x8, 'd': 0x9, 'f': 0xE,
+    'z': 0xA, 'x': 0x0, 'c': 0xB, 'v': 0xF,
+}
+
+QUIT_KEY = 27
+
+
+# State of the 16 keys, filled by an input backend
+class Keypad(object):
+    def __init__(self):
+        self.state = bytearray(16)
+
+        # Called with the key on every press and release
+        self.listeners = []
+        self.release_listeners = []
+
+    def press(self, key):
+        self.state[key] = 1
+
+        for listener in self.listeners:
+            listener(key)
+
+    def release(self, key):
+        self.state[key] = 0
+
+        for listener in self.release_listeners:
+            listener(key)
+
+    def is_pressed(self, key):
+        return self.state[key] == 1
+
+    def reset(self):
+        self.state[:] = bytes(16)
+
+
+# Polls the curses window without blocking
+# Terminals do not report key releases, so a key is held for hold_frames
+# polls after it was last seen.
+class CursesInput(object):
+    def __init__(self, window, keypad, key_map=KEY_MAP, hold_frames=6):
+        self.window = window
+        self.keypad = keypad
+        self.key_map = {ord(key): value for key, value in key_map.items()}
+        self.hold_frames = hold_frames
+        self.held = {}
+
+    # Called once per frame
+    def poll(self):
+        for key in list(self.held):
+            self.held[key] -= 1
+            if self.held[key] <= 0:
+                del self.held[key]
+                self.keypad.release(key)
+
+        key = self.window.getch()
+        while key != -1:
+            if key == QUIT_KEY:
+                curses.endwin()
+                exit(0)
+
+            if key in self.key_map:
+                self.held[self.key_map[key]] = self.hold_frames
+                self.keypad.press(self.key_map[key])
+
+            key = self.window.getch()
+
+
+# Replays (frame, key, pressed) events, for headless runs
+class ScriptedInput(object):
+    def __init__(self, keypad, events=()):
+        self.keypad = keypad
+        self.events = sorted(events, key=lambda event: event[0])
+        self.position = 0
+        self.frame = 0
+
+    # Called once per frame
+    def poll(self):
+        events = self.events
+        while (self.position < len(events) and
+               events[self.position][0] <= self.frame):
+            _, key, pressed = events[self.position]
+            if pressed:
+                self.keypad.press(key)
+            else:
+                self.keypad.release(key)
+
+            self.position += 1
+
+        self.frame += 1
+
+
+# Applies (key, pressed) events queued by another producer, such as an
+# asyncio session or a network handler
+class QueueInput(object):
+    def __init__(self, keypad, queue=None):
+        self.keypad = keypad
+        self.queue = queue if queue is not None else deque()
+
+    # Called once per frame
+    def poll(self):
+        queue = self.queue
+        while queue:
+            key, pressed = queue.popleft()
+            if pressed:
+                self.keypad.press(key)
+            else:
+                self.keypad.release(key)
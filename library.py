@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+from rom import open_rom, check_rom_size
+
+
+# Index of ROM files keyed by the SHA-1 of their content
+# Files whose size and modification time did not change since they were
+# indexed are not read again; ROM data is loaded on first use and shared
+# by every file with the same content. The file part of the index can be
+# persisted with save().
+class RomLibrary(object):
+    def __init__(self, index_file=None):
+        self.index_file = index_file
+
+        # path -> {'sha1', 'size', 'mtime'}
+        self.files = {}
+        # sha1 -> {'sha1', 'size', 'paths'}
+        self.roms = {}
+
+        self.data = {}
+
+        if index_file and os.path.exists(index_file):
+            with open(index_file) as file:
+                index = json.load(file)
+            self.files = index['files']
+            self.roms = index['roms']
+
+    def save(self, index_file=None):
+        with open(index_file or self.index_file, 'w') as file:
+            json.dump({'files': self.files, 'roms': self.roms}, file)
+
+    # Index path, returning its hash
+    def add(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.files.get(path)
+        if (known and known['size'] == stat.st_size and
+                known['mtime'] == stat.st_mtime):
+            return known['sha1']
+
+        with open_rom(path) as data:
+            check_rom_size(len(data))
+            sha1 = hashlib.sha1(data).hexdigest()
+            self.data.setdefault(sha1, bytes(data))
+
+        # A path whose content changed leaves the entry of its old content
+        if known and known['sha1'] != sha1:
+            self.remove_path(known['sha1'], path)
+
+        self.files[path] = {'sha1': sha1, 'size': stat.st_size,
+                            'mtime': stat.st_mtime}
+        rom = self.roms.setdefault(sha1, {'sha1': sha1, 'size': stat.st_size,
+                                          'paths': []})
+        if path not in rom['paths']:
+            rom['paths'].append(path)
+
+        return sha1
+
+    # Drop path from the files of content sha1, and the content with its
+    # last path
+    def remove_path(self, sha1, path):
+        rom = self.roms.get(sha1)
+        if rom is None:
+            return
+
+        if path in rom['paths']:
+            rom['paths'].remove(path)
+        if not rom['paths']:
+            del self.roms[sha1]
+            self.data.pop(sha1, None)
+
+    # Index every ROM in directory, returning their hashes
+    def scan(self, directory, extension='.ch8'):
+        return [self.add(os.path.join(directory, name))
+                for name in sorted(os.listdir(directory))
+                if name.endswith(extension)]
+
+    # Content of sha1, read from the first of its files that still holds it
+    def rom_data(self, sha1):
+        if sha1 not in self.data:
+            for path in self.roms[sha1]['paths']:
+                try:
+                    with open_rom(path) as data:
+                        if hashlib.sha1(data).hexdigest() == sha1:
+                            self.data[sha1] = bytes(data)
+                            break
+                except OSError:
+                    continue
+            else:
+                raise ValueError('No file holds ROM %s anymore' % sha1)
+
+        return self.data[sha1]
@@ -1,50 +1,96 @@
 import time
+import argparse
 from cpu import Chip8CPU
-from screen import Screen
-
-
-fontset = [
-    0xF0, 0x90, 0x90, 0x90, 0xF0,		# 0
-    0x20, 0x60, 0x20, 0x20, 0x70,		# 1
-    0xF0, 0x10, 0xF0, 0x80, 0xF0,		# 2
-    0xF0, 0x10, 0xF0, 0x10, 0xF0,		# 3
-    0x90, 0x90, 0xF0, 0x10, 0x10,		# 4
-    0xF0, 0x80, 0xF0, 0x10, 0xF0,		# 5
-    0xF0, 0x80, 0xF0, 0x90, 0xF0,		# 6
-    0xF0, 0x10, 0x20, 0x40, 0x40,		# 7
-    0xF0, 0x90, 0xF0, 0x90, 0xF0,		# 8
-    0xF0, 0x90, 0xF0, 0x10, 0xF0,		# 9
-    0xF0, 0x90, 0xF0, 0x90, 0x90,		# A
-    0xE0, 0x90, 0xE0, 0x90, 0xE0,		# B
-    0xF0, 0x80, 0x80, 0x80, 0xF0,		# C
-    0xE0, 0x90, 0x90, 0x90, 0xE0,		# D
-    0xF0, 0x80, 0xF0, 0x80, 0xF0,		# E
-    0xF0, 0x80, 0xF0, 0x80, 0x80		# F
-]
-
-
-def run():
-    filename = 'space_invaders.ch8'
-    screen = Screen(filename)
-    cpu = Chip8CPU(screen)
-
-    cpu.load_rom('FONTS.chip8', 0)
-    # cpu.load_font(fontset)
+from screen import Screen, HeadlessScreen
+from debug import DebugSampler
+from scheduler import Scheduler
+from keypad import CursesInput
+from journal import Recorder
+from stream import FrameWriter
+from quirks import QUIRK_PROFILES
+
+
+# Run instructions as fast as possible, without presenting frames,
+# and report the interpreter throughput
+def run_unthrottled(cpu, cycles):
+    execute_instruction = cpu.execute_instruction
+
+    start = time.perf_counter()
+    for _ in range(cycles):
+        execute_instruction()
+    elapsed = time.perf_counter() - start
+
+    print('%d instructions in %.3fs (%d instructions/s)' %
+          (cycles, elapsed, cycles / elapsed))
+
+    return cycles / elapsed
+
+
+def run(filename='space_invaders.ch8', headless=False, unthrottled=False,
+        cycles=1000000, debug_mode='frame', debug_interval=1000,
+        breakpoints=(), frequency=500, seed=None, record=None,
+        capture=None, quirks=None):
+    screen = HeadlessScreen(filename) if headless else Screen(filename)
+    cpu = Chip8CPU(screen, seed, quirks)
+    sampler = DebugSampler(cpu, screen, 'off' if headless else debug_mode,
+                           debug_interval, breakpoints)
+
     cpu.load_rom(filename)
 
-    while True:
-        # screen.draw_pixel(0, 0, 1)
-        # screen.draw_pixel(0, 1, 1)
-        # screen.draw_pixel(0, 2, 1)
-        # screen.draw_pixel(0, 3, 1)
-        # screen.draw_pixel(0, 4, 1)
-        # screen.draw_pixel(1, 4, 1)
-        # screen.draw_pixel(2, 4, 1)
-        # screen.draw_pixel(3, 4, 1)
-        # screen.draw_pixel(4, 4, 1)
-        cpu.execute_instruction()
-        screen.update()
+    if unthrottled:
+        return run_unthrottled(cpu, cycles)
+
+    input_device = None if headless else CursesInput(screen.display_window,
+                                                     cpu.keypad)
+    scheduler = Scheduler(cpu, screen, frequency, input_device=input_device)
+    scheduler.frame_listeners.append(sampler.frame)
+
+    if capture:
+        writer = FrameWriter(capture, screen.width, screen.height)
+        scheduler.frame_listeners.append(
+            lambda: writer.write(scheduler.frames, screen.to_bytes()))
+
+    recorder = Recorder(scheduler, seed) if record else None
+    try:
+        scheduler.run()
+    finally:
+        if recorder:
+            recorder.stop().save(record)
+        if capture:
+            writer.close()
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description='Chip8 Emulator')
+    parser.add_argument('rom', nargs='?', default='space_invaders.ch8')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without the curses interface')
+    parser.add_argument('--unthrottled', action='store_true',
+                        help='run headless as fast as possible and report '
+                             'instructions per second')
+    parser.add_argument('--cycles', type=int, default=1000000,
+                        help='instructions to run in unthrottled mode')
+    parser.add_argument('--debug', default='frame',
+                        choices=['off', 'every', 'frame', 'breakpoint'],
+                        help='when to refresh the debug pane')
+    parser.add_argument('--debug-interval', type=int, default=1000,
+                        help='instructions between samples in "every" mode')
+    parser.add_argument('--breakpoint', type=lambda value: int(value, 16),
+                        action='append', default=[],
+                        help='address (hex) sampled in "breakpoint" mode')
+    parser.add_argument('--frequency', type=int, default=500,
+                        help='CPU frequency in Hz, 0 runs unlimited')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the random number generator')
+    parser.add_argument('--record', default=None,
+                        help='record input and timers into a journal file')
+    parser.add_argument('--capture', default=None,
+                        help='record the presented frames into a file')
+    parser.add_argument('--quirks', choices=sorted(QUIRK_PROFILES),
+                        default=None,
+                        help='compatibility quirk profile of the ROM')
+    args = parser.parse_args()
+
+    run(args.rom, args.headless or args.unthrottled, args.unthrottled,
+        args.cycles, args.debug, args.debug_interval, args.breakpoint,
+        args.frequency, args.seed, args.record, args.capture, args.quirks)
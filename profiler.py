@@ -0,0 +1,205 @@
+import json
+import argparse
+from time import perf_counter_ns
+
+
+# Instruction patterns by most significant nibble, for opcodes without
+# sub operations
+PATTERNS = {
+    0x1: '1nnn', 0x2: '2nnn', 0x3: '3xkk', 0x4: '4xkk', 0x5: '5xy0',
+    0x6: '6xkk', 0x7: '7xkk', 0x9: '9xy0', 0xA: 'Annn', 0xB: 'Bnnn',
+    0xC: 'Cxkk', 0xD: 'Dxyn',
+}
+
+# System opcodes with a class of their own, any other 0nnn but the 00Cn
+# and 00Dn scrolls is a machine code call
+SYSTEM_OPCODES = (0x00E0, 0x00EE, 0x00FB, 0x00FC, 0x00FE, 0x00FF)
+
+
+# Opcode class, e.g. '7xkk', '8xy4' or 'Fx1E'
+def opcode_class(opcode):
+    operation = (opcode & 0xF000) >> 12
+
+    if operation == 0x0:
+        if opcode & 0xFFF0 in (0x00C0, 0x00D0):
+            return '%03Xn' % (opcode >> 4)
+        return '%04X' % opcode if opcode in SYSTEM_OPCODES else '0nnn'
+    if operation == 0xD and not opcode & 0x000F:
+        return 'Dxy0'
+    if operation == 0x8:
+        return '8xy%X' % (opcode & 0x000F)
+    if operation in (0xE, 0xF):
+        return '%Xx%02X' % (operation, opcode & 0x00FF)
+
+    return PATTERNS[operation]
+
+
+# Opt-in instruction profiler
+# While attached, every instruction decoded by the CPU is wrapped in a
+# probe counting executions per address and per opcode class, the host
+# time spent in each handler and the 2nnn/00EE call graph. Detaching
+# flushes the probes out of the decode cache, so a CPU that is not being
+# profiled runs exactly the same code as before.
+class Profiler(object):
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.attached = False
+        self.reset()
+
+    def reset(self):
+        self.pc_counts = [0] * len(self.cpu.memory)
+        self.class_counts = {}
+        self.handler_calls = {}
+        self.handler_time = {}
+        self.call_edges = {}
+
+        # Entry addresses of the subroutines being executed
+        self.call_stack = [self.cpu.registers.pc]
+
+    def attach(self):
+        if not self.attached:
+            self.cpu.decode_at = self.decode_at
+            self.cpu.flush_decode_cache()
+            self.attached = True
+
+    def detach(self):
+        if self.attached:
+            del self.cpu.decode_at
+            self.cpu.flush_decode_cache()
+            self.attached = False
+
+    # Replacement for Chip8CPU.decode_at
+    def decode_at(self, address):
+        opcode, operation = type(self.cpu).decode_at(self.cpu, address)
+        return opcode, self.probe(address, opcode, operation)
+
+    # Wrap operation decoded at address
+    def probe(self, address, opcode, operation):
+        pc_counts = self.pc_counts
+        class_counts = self.class_counts
+        handler_calls = self.handler_calls
+        handler_time = self.handler_time
+        label = opcode_class(opcode)
+        name = getattr(operation, 'func', operation).__name__
+        class_counts.setdefault(label, 0)
+        handler_calls.setdefault(name, 0)
+        handler_time.setdefault(name, 0)
+
+        if name == 'call_subroutine':
+            edge = opcode & 0x0FFF
+            record = self.record_call
+        elif name == 'return_from_subroutine':
+            edge = None
+            record = self.record_return
+        else:
+            record = None
+
+        def probe():
+            start = perf_counter_ns()
+            operation()
+            elapsed = perf_counter_ns() - start
+
+            pc_counts[address] += 1
+            class_counts[label] += 1
+            handler_calls[name] += 1
+            handler_time[name] += elapsed
+
+            if record:
+                record(edge)
+
+        return probe
+
+    def record_call(self, target):
+        edge = (self.call_stack[-1], target)
+        self.call_edges[edge] = self.call_edges.get(edge, 0) + 1
+        self.call_stack.append(target)
+
+    def record_return(self, _):
+        if len(self.call_stack) > 1:
+            self.call_stack.pop()
+
+    # Report as plain data
+    def to_dict(self, top=20):
+        hot = sorted(((count, address) for address, count
+                      in enumerate(self.pc_counts) if count),
+                     reverse=True)[:top]
+
+        return {
+            'instructions': sum(self.class_counts.values()),
+            'hot_pcs': [{'pc': hex(address), 'count': count}
+                        for count, address in hot],
+            'classes': dict(sorted(self.class_counts.items(),
+                                   key=lambda item: -item[1])),
+            'handlers': {
+                name: {
+                    'calls': calls,
+                    'total_ns': self.handler_time[name],
+                    'ns_per_call': (self.handler_time[name] / calls
+                                    if calls else 0),
+                } for name, calls in sorted(self.handler_calls.items(),
+                                            key=lambda item: -item[1])
+            },
+            'call_edges': [{'caller': hex(caller), 'callee': hex(callee),
+                            'count': count} for (caller, callee), count
+                           in sorted(self.call_edges.items(),
+                                     key=lambda item: -item[1])],
+        }
+
+    def report_json(self, top=20):
+        return json.dumps(self.to_dict(top), indent=2)
+
+    def report_text(self, top=20):
+        report = self.to_dict(top)
+        lines = ['%d instructions' % report['instructions'], '',
+                 'Hot addresses:']
+        lines.extend('  %6s %10d' % (entry['pc'], entry['count'])
+                     for entry in report['hot_pcs'])
+
+        lines.extend(['', 'Opcode classes:'])
+        lines.extend('  %6s %10d' % item for item in report['classes'].items())
+
+        lines.extend(['', 'Handlers:%31s %12s %10s' % (
+            'calls', 'total ns', 'ns/call')])
+        lines.extend('  %-28s %10d %12d %10.1f' % (
+            name, handler['calls'], handler['total_ns'],
+            handler['ns_per_call'])
+            for name, handler in report['handlers'].items())
+
+        lines.extend(['', 'Call graph:'])
+        lines.extend('  %6s -> %6s %10d' % (
+            edge['caller'], edge['callee'], edge['count'])
+            for edge in report['call_edges'])
+
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    from cpu import Chip8CPU
+    from screen import HeadlessScreen
+
+    parser = argparse.ArgumentParser(description='Profile a Chip8 ROM')
+    parser.add_argument('rom')
+    parser.add_argument('--cycles', type=int, default=100000)
+    parser.add_argument('--frequency', type=int, default=500,
+                        help='CPU frequency in Hz, paces the timers')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    cpu = Chip8CPU(HeadlessScreen(args.rom))
+    cpu.load_rom(args.rom)
+
+    profiler = Profiler(cpu)
+    profiler.attach()
+    cycles_per_frame = max(args.frequency // 60, 1)
+    for cycle in range(args.cycles):
+        if cpu.key_wait is not None:
+            break
+
+        cpu.execute_instruction()
+        if cycle % cycles_per_frame == cycles_per_frame - 1:
+            cpu.tick_timers()
+    profiler.detach()
+
+    print(profiler.report_json(args.top) if args.json
+          else profiler.report_text(args.top))
@@ -0,0 +1,55 @@
+# Compatibility quirk profiles
+# Interpreters disagree on a handful of instructions. The base Chip8CPU
+# handlers shift vx in place (8xy6, 8xyE), leave I unchanged after Fx55
+# and Fx65, jump to nnn + V0 (Bnnn) and leave VF alone after 8xy1 to
+# 8xy3. A profile maps the base handler names it changes to the names of
+# the variants implementing that interpreter's behaviour; the variants
+# are bound into the CPU dispatch table once, when the CPU is created.
+
+# 8xy6 and 8xyE shift vy into vx
+SHIFT_VY = {
+    'shr_vx': 'shr_vy',
+    'shl_vx': 'shl_vy',
+}
+
+# 8xy1, 8xy2 and 8xy3 reset VF
+LOGIC_RESET_VF = {
+    'load_or_vy_into_vx': 'load_or_vy_into_vx_reset_vf',
+    'load_and_vy_into_vx': 'load_and_vy_into_vx_reset_vf',
+    'load_xor_vy_into_vx': 'load_xor_vy_into_vx_reset_vf',
+}
+
+# Fx55 and Fx65 leave I past the last register
+ADVANCE_INDEX = {
+    'store_registers': 'store_registers_advance_index',
+    'load_registers': 'load_registers_advance_index',
+}
+
+# Fx55 and Fx65 leave I on the last register (CHIP-48 off by one)
+ADVANCE_INDEX_BY_X = {
+    'store_registers': 'store_registers_advance_index_by_x',
+    'load_registers': 'load_registers_advance_index_by_x',
+}
+
+# Bxnn jumps to xnn + vx
+JUMP_VX = {
+    'jump_to_location_plus_v0': 'jump_to_location_plus_vx',
+}
+
+QUIRK_PROFILES = {
+    'vip': dict(SHIFT_VY, **LOGIC_RESET_VF, **ADVANCE_INDEX),
+    'chip48': dict(ADVANCE_INDEX_BY_X, **JUMP_VX),
+    'schip': dict(JUMP_VX),
+}
+
+
+# Handler name substitutions of profile, None being the base handlers
+def quirk_profile(name):
+    if name is None:
+        return {}
+
+    if name not in QUIRK_PROFILES:
+        raise ValueError('Unknown quirk profile: %s (expected one of %s)' % (
+            name, ', '.join(sorted(QUIRK_PROFILES))))
+
+    return QUIRK_PROFILES[name]
@@ -0,0 +1,43 @@
+from array import array
+
+
+# Register file of a Chip8 CPU
+# V registers live in a bytearray, so they always hold 8 bit values; PC,
+# I (index), SP and the delay and sound timers are plain attributes.
+# Indexing by name (registers['pc'], registers['v'], timers['delay']) is
+# kept for code written against the old dictionaries.
+class RegisterFile(object):
+    __slots__ = ('v', 'pc', 'index', 'sp', 'delay', 'sound')
+
+    def __init__(self):
+        self.v = bytearray(16)
+        self.reset()
+
+    # Clear every register in place, V keeps its identity
+    def reset(self):
+        self.v[:] = bytes(16)
+        self.pc = 0x0200
+        self.index = 0
+        self.sp = 0
+        self.delay = 0
+        self.sound = 0
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if name not in self.__slots__:
+            raise KeyError(name)
+
+        if name == 'v':
+            self.v[:] = value
+        else:
+            setattr(self, name, value)
+
+
+# Return address stack, 16 entries of 16 bits
+def create_stack():
+    return array('H', bytes(32))
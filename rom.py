@@ -0,0 +1,27 @@
+import os
+import mmap
+from contextlib import contextmanager
+
+
+ROM_START = 0x200
+MEMORY_END = 0x1000
+
+
+# Map a ROM file read-only
+# Yields a buffer that can be sliced into memory without an extra copy.
+@contextmanager
+def open_rom(filename):
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b''
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+# Ensure size bytes loaded at offset fit in memory
+def check_rom_size(size, offset=ROM_START):
+    if offset + size > MEMORY_END:
+        raise ValueError('ROM of %d bytes does not fit at %s (max %d bytes)'
+                         % (size, hex(offset), MEMORY_END - offset))
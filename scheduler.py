@@ -0,0 +1,115 @@
+import time
+
+
+# Paces the CPU at a fixed frequency, independently from the 60 Hz frame
+# clock that decrements the timers and presents frames.
+# Frame deadlines advance by exact periods of a monotonic clock, so sleep
+# inaccuracies do not accumulate. When the host falls behind, frames are
+# emulated without being presented (up to max_frame_skip in a row); past
+# that, the schedule is reset to the current time.
+class Scheduler(object):
+    def __init__(self, cpu, screen, cpu_hz=500, frame_hz=60,
+                 max_frame_skip=5, execute=None, input_device=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.cpu = cpu
+        self.screen = screen
+        self.input_device = input_device
+        self.cpu_hz = cpu_hz
+        self.frame_period = 1.0 / frame_hz
+        self.max_frame_skip = max_frame_skip
+        self.execute = execute or self.interpret
+        self.clock = clock
+        self.sleep = sleep
+
+        # Callables run right before a frame is presented, and after every
+        # timer tick
+        self.frame_listeners = []
+        self.tick_listeners = []
+
+        # Instructions per frame. With no cpu_hz the CPU runs unlimited,
+        # checking the clock after every chunk of instructions.
+        self.cycles_per_frame = cpu_hz / frame_hz if cpu_hz else 0
+        self.chunk = 256
+        self.cycle_budget = 0.0
+
+        self.frames = 0
+        self.frames_skipped = 0
+        self.instructions = 0
+
+    # Default engine, looks execute_instruction up on every call so CPU
+    # hooks attached while running are honoured
+    def interpret(self, cycles):
+        cpu = self.cpu
+        for _ in range(cycles):
+            cpu.execute_instruction()
+
+        return cycles
+
+    # Run the CPU for one frame worth of instructions
+    # Nothing runs while the CPU waits for a key (Fx0A).
+    def emulate(self, deadline):
+        cpu = self.cpu
+        if self.input_device:
+            self.input_device.poll()
+
+        if cpu.key_wait is not None:
+            return
+
+        if self.cycles_per_frame:
+            self.cycle_budget += self.cycles_per_frame
+            cycles = int(self.cycle_budget)
+            if cycles > 0:
+                executed = self.execute(cycles)
+                self.cycle_budget -= executed
+                self.instructions += executed
+        else:
+            clock = self.clock
+            while clock() < deadline and cpu.key_wait is None:
+                self.instructions += self.execute(self.chunk)
+
+    # Tick the timers, ending a frame
+    def tick(self):
+        self.cpu.tick_timers()
+        for listener in self.tick_listeners:
+            listener()
+        self.frames += 1
+
+    # Emulate one frame and tick the timers
+    def advance(self, deadline):
+        self.emulate(deadline)
+        self.tick()
+
+    def present(self):
+        for listener in self.frame_listeners:
+            listener()
+
+        self.screen.update()
+
+    # Run for the given number of frames, or forever
+    def run(self, frames=None):
+        clock = self.clock
+        period = self.frame_period
+        next_frame = clock()
+        skipped = 0
+        count = 0
+
+        while frames is None or count < frames:
+            deadline = next_frame + period
+            self.advance(deadline)
+            count += 1
+
+            # Unlimited mode fills each frame up to its deadline by design
+            late = self.cycles_per_frame and clock() > deadline
+            if not late or skipped >= self.max_frame_skip:
+                self.present()
+                skipped = 0
+            else:
+                self.frames_skipped += 1
+                skipped += 1
+
+            next_frame = deadline
+            now = clock()
+            if now < next_frame:
+                self.sleep(next_frame - now)
+            elif now - next_frame > self.max_frame_skip * period:
+                next_frame = now
@@ -1,9 +1,32 @@
 import curses
+import locale
 
 
-class Screen(object):
-    def __init__(self, filename=None):
-        self.display = [0] * 32 * 64
+# Display resolutions: CHIP-8 low resolution and SUPER-CHIP high resolution
+LOW_RESOLUTION = (64, 32)
+HIGH_RESOLUTION = (128, 64)
+RESOLUTIONS = (LOW_RESOLUTION, HIGH_RESOLUTION)
+
+
+# Terminal cells of the curses display. A cell shows one low resolution
+# pixel, or a 2x2 block of high resolution pixels as a quadrant character.
+CELL_COLUMNS = 64
+CELL_LINES = 32
+
+# Quadrant characters by lit pixels, the top left, top right, bottom left
+# and bottom right pixels being bits 0 to 3
+QUADRANTS = u' \u2598\u259d\u2580\u2596\u258c\u259e\u259b' \
+            u'\u2597\u259a\u2590\u259c\u2584\u2599\u259f\u2588'
+
+
+# Framebuffer without any terminal I/O, used for headless runs
+# The display is stored as one integer per row, the leftmost pixel being
+# the most significant bit, so scrolls are row list and bit shifts.
+class HeadlessScreen(object):
+    def __init__(self, filename=None, resolution=LOW_RESOLUTION):
+        self.width, self.height = resolution
+        self.display = [0] * self.height
+        self.dirty = False
         self.counter = 0
         self.filename = filename
         self.debug_info = {
@@ -17,21 +40,114 @@ class Screen(object):
             'str': ''
         }
 
-        self.init_hud()
+    # Switch to another resolution, clearing the display
+    def set_resolution(self, resolution):
+        self.width, self.height = resolution
+        self.clear()
 
     def get_pixel(self, x_pos, y_pos):
-        try:
-            return self.display[y_pos * 64 + x_pos]
-        except IndexError:
-            return 0
+        if 0 <= x_pos < self.width and 0 <= y_pos < self.height:
+            return (self.display[y_pos] >> (self.width - 1 - x_pos)) & 1
+
+        return 0
 
     def draw_pixel(self, x_pos, y_pos, pixel):
-        try:
-            self.display[y_pos * 64 + x_pos] = pixel
-        except:
-            pass
+        if 0 <= x_pos < self.width and 0 <= y_pos < self.height:
+            mask = 1 << (self.width - 1 - x_pos)
+            if pixel:
+                self.display[y_pos] |= mask
+            else:
+                self.display[y_pos] &= ~mask
+
+            self.dirty = True
+
+    # XOR sprite rows into the display, returning 1 on collision
+    # Sprite rows are sprite_width bits wide (8, or 16 for SUPER-CHIP
+    # 16x16 sprites). The sprite origin wraps around the screen, pixels
+    # past the right and bottom edges are clipped.
+    def draw_sprite(self, x_pos, y_pos, sprite, sprite_width=8):
+        x_pos %= self.width
+        y_pos %= self.height
+        shift = self.width - sprite_width - x_pos
+        display = self.display
+        collision = 0
+
+        for y_coord, line in zip(range(y_pos, self.height), sprite):
+            bits = line << shift if shift >= 0 else line >> -shift
+            row = display[y_coord]
+            if row & bits:
+                collision = 1
+
+            display[y_coord] = row ^ bits
+
+        self.dirty = True
+        return collision
+
+    # Scrolls by whole pixels of the current resolution
+    def scroll_down(self, lines):
+        lines = min(lines, self.height)
+        self.display[lines:] = self.display[:self.height - lines]
+        self.display[:lines] = [0] * lines
+        self.dirty = True
+
+    def scroll_up(self, lines):
+        lines = min(lines, self.height)
+        self.display[:self.height - lines] = self.display[lines:]
+        self.display[self.height - lines:] = [0] * lines
+        self.dirty = True
+
+    def scroll_right(self, columns=4):
+        self.display = [row >> columns for row in self.display]
+        self.dirty = True
+
+    def scroll_left(self, columns=4):
+        mask = (1 << self.width) - 1
+        self.display = [(row << columns) & mask for row in self.display]
+        self.dirty = True
+
+    # Packed framebuffer, row by row
+    def to_bytes(self):
+        row_size = self.width // 8
+        return b''.join(row.to_bytes(row_size, 'big') for row in self.display)
+
+    # Load a framebuffer produced by to_bytes
+    # A framebuffer of another resolution switches the screen to it.
+    def from_bytes(self, data):
+        if len(data) != self.width * self.height // 8:
+            for resolution in RESOLUTIONS:
+                if len(data) == resolution[0] * resolution[1] // 8:
+                    self.set_resolution(resolution)
+                    break
+            else:
+                raise ValueError('No resolution holds a %d byte framebuffer'
+                                 % len(data))
+
+        row_size = self.width // 8
+        self.display = [int.from_bytes(data[offset:offset + row_size], 'big')
+                        for offset in range(0, len(data), row_size)]
+        self.dirty = True
+
+    def update_debug_info(self, debug_info={}):
+        self.debug_info.update(debug_info)
+
+    def clear(self):
+        self.display = [0] * self.height
+        self.dirty = True
+
+    def update(self):
+        self.counter += 1
+
+
+# Curses frontend
+class Screen(HeadlessScreen):
+    def __init__(self, filename=None, resolution=LOW_RESOLUTION):
+        super(Screen, self).__init__(filename, resolution)
+
+        self.init_hud()
 
     def init_hud(self):
+        # Quadrant characters need the locale encoding
+        locale.setlocale(locale.LC_ALL, '')
         self.stdscr = curses.initscr()
 
         curses.noecho()
@@ -48,26 +164,36 @@ class Screen(object):
         self.stdscr.addstr('Chip8 Emulator', curses.A_REVERSE)
         self.stdscr.chgat(-1, curses.A_REVERSE)
 
-        self.display_window = curses.newwin(34, 68, 3, 3)
+        self.display_window = curses.newwin(CELL_LINES + 2,
+                                            CELL_COLUMNS + 4, 3, 3)
         self.display_window.keypad(1)
-        self.display_window.timeout(16)
+        self.display_window.nodelay(1)
         self.display_window.box()
 
         if self.filename:
             self.display_window.addstr(0, 2, self.filename)
 
         max_width = self.stdscr.getmaxyx()[1]
-        self.debug_window = curses.newwin(34, max_width - 75, 3, 72)
-        self.debug_window.timeout(16)
+        self.debug_window = curses.newwin(CELL_LINES + 2, max_width - 75, 3,
+                                          CELL_COLUMNS + 8)
+        self.debug_window.nodelay(1)
         self.debug_window.box()
         self.debug_window.addstr(0, 2, 'debug')
 
+        # Rows as last drawn on the terminal, None to redraw everything
+        self.presented = None
+        self.present()
+
         self.update_debug_info()
+        self.stdscr.refresh()
+        self.display_window.refresh()
+        self.debug_window.refresh()
 
     def update_debug_info(self, debug_info={}):
         # self.debug_window.clear()
         self.debug_window.box()
-        self.debug_info.update(debug_info)
+        super(Screen, self).update_debug_info(debug_info)
+        self.debug_dirty = True
         self.debug_window.addstr(1, 2, 'PC: %s' % self.debug_info['pc'])
 
         line = 2
@@ -95,43 +221,88 @@ class Screen(object):
         self.debug_window.addstr(line + 3, 2, 'sprite: %s' %
                                  self.debug_info['sprite'])
 
-    def clear(self):
-        self.display = [0] * 32 * 64
-
-    def update(self, callback=None):
-        self.counter += 1
+    def set_resolution(self, resolution):
+        super(Screen, self).set_resolution(resolution)
+        self.presented = None
 
-        # self.display_window.box()
-        # self.display_window.addstr(0, 0, '%s count' % (self.counter % 100))
+    # Draw the cells flagged in changed for one low resolution row
+    def draw_cells(self, line, changed, row):
         padding_y = 1
         padding_x = 2
-        # for x_index, line in enumerate(self.display):
-        #     for y_index, pixel in enumerate(line):
-        #         self.display_window.addstr(
-        #             padding + x_index, padding + 1 + y_index, '#' if pixel else ' ')
+        on = curses.color_pair(1) | curses.A_BOLD | curses.A_REVERSE
+        off = curses.color_pair(1) | curses.A_BOLD
 
-        for index in range(32 * 64):
-            line = index // 64
-            column = index % 64
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            column = self.width - bit.bit_length()
 
-            pixel = self.display[index]
+            self.display_window.addstr(
+                padding_y + line, padding_x + column, ' ',
+                on if row & bit else off)
+
+    # Draw the quadrant cells flagged in changed for a pair of high
+    # resolution rows. Only the even bit of each changed pixel pair is
+    # kept, so every cell is drawn once.
+    def draw_quadrants(self, line, changed, top, bottom):
+        padding_y = 1
+        padding_x = 2
+        attributes = curses.color_pair(1) | curses.A_BOLD
+
+        changed = (changed | (changed >> 1)) & self.even_bits
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            position = bit.bit_length() - 1
+            column = (self.width - 2 - position) // 2
+            quadrant = (((top >> (position + 1)) & 1) |
+                        ((top >> position) & 1) << 1 |
+                        ((bottom >> (position + 1)) & 1) << 2 |
+                        ((bottom >> position) & 1) << 3)
 
-            if pixel == 1:
-                pair = curses.color_pair(1) | curses.A_BOLD | curses.A_REVERSE
-            else:
-                pair = curses.color_pair(1) | curses.A_BOLD
             self.display_window.addstr(
-                padding_y + line, padding_x + column, ' ', pair)
+                padding_y + line, padding_x + column, QUADRANTS[quadrant],
+                attributes)
 
-        self.stdscr.refresh()
-        self.display_window.refresh()
-        self.debug_window.refresh()
+    # Redraw only the cells that changed since the last present
+    def present(self):
+        display = self.display
+        if self.presented is None:
+            mask = (1 << self.width) - 1
+            self.presented = [row ^ mask for row in display]
+            self.even_bits = int('01' * (self.width // 2), 2)
+
+        presented = self.presented
+        if self.width == CELL_COLUMNS:
+            for line, row in enumerate(display):
+                changed = row ^ presented[line]
+                if changed:
+                    self.draw_cells(line, changed, row)
+                    presented[line] = row
+        else:
+            for line in range(CELL_LINES):
+                top = display[2 * line]
+                bottom = display[2 * line + 1]
+                changed = ((top ^ presented[2 * line]) |
+                           (bottom ^ presented[2 * line + 1]))
+                if changed:
+                    self.draw_quadrants(line, changed, top, bottom)
+                    presented[2 * line] = top
+                    presented[2 * line + 1] = bottom
+
+        self.dirty = False
+        self.display_window.noutrefresh()
+
+    def update(self):
+        super(Screen, self).update()
+
+        refresh = self.dirty or self.debug_dirty
+        if self.dirty:
+            self.present()
 
-        key = self.display_window.getch()
-        if key == ord('q'):
-            curses.endwin()
-            exit(0)
+        if self.debug_dirty:
+            self.debug_window.noutrefresh()
+            self.debug_dirty = False
 
-        elif key == ord('c'):
-            if callback:
-                callback()
+        if refresh:
+            curses.doupdate()
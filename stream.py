@@ -0,0 +1,269 @@
+import time
+import zlib
+import struct
+import argparse
+
+
+# Recording layout: magic, version, width, height, frame rate, then one
+# packet per stored frame. A packet is kind, compression method, frame
+# number and payload size, followed by the payload. The header holds the
+# initial resolution; a resolution switch starts with a keyframe of the
+# new size.
+STREAM_MAGIC = b'C8FS'
+STREAM_VERSION = 1
+HEADER_FORMAT = struct.Struct('<4sBHHB')
+PACKET_FORMAT = struct.Struct('<BBIH')
+
+# Packet kinds: a whole framebuffer, or its XOR with the previous one
+KEYFRAME = 0
+DELTA = 1
+
+# Compression methods
+RAW = 0
+RLE = 1
+ZLIB = 2
+
+
+# Run-length encoding as (count, value) byte pairs
+# XOR deltas are mostly zero, so they shrink to a handful of pairs.
+def rle_encode(data):
+    encoded = bytearray()
+    position = 0
+    size = len(data)
+
+    while position < size:
+        value = data[position]
+        end = position + 1
+        while end < size and end - position < 255 and data[end] == value:
+            end += 1
+
+        encoded.append(end - position)
+        encoded.append(value)
+        position = end
+
+    return bytes(encoded)
+
+
+def rle_decode(data):
+    decoded = bytearray()
+    for position in range(0, len(data), 2):
+        decoded.extend(data[position + 1:position + 2] * data[position])
+
+    return bytes(decoded)
+
+
+# (compress, decompress) by method
+COMPRESSORS = {
+    RAW: (bytes, bytes),
+    RLE: (rle_encode, rle_decode),
+    ZLIB: (zlib.compress, zlib.decompress),
+}
+
+
+def xor_bytes(data, other):
+    return (int.from_bytes(data, 'big') ^
+            int.from_bytes(other, 'big')).to_bytes(len(data), 'big')
+
+
+# Turns packed framebuffers (HeadlessScreen.to_bytes) into packets
+# Frames identical to the previous one produce no packet at all. A
+# keyframe is emitted first, every keyframe_interval frames and whenever
+# the framebuffer size changes, so a viewer can join at any keyframe.
+class FrameEncoder(object):
+    def __init__(self, method=ZLIB, keyframe_interval=120):
+        self.method = method
+        self.keyframe_interval = keyframe_interval
+        self.previous = None
+        self.keyframe = 0
+
+    # Packet for frame number, or None when nothing changed
+    def encode(self, number, framebuffer):
+        framebuffer = bytes(framebuffer)
+        previous = self.previous
+
+        if (previous is None or len(previous) != len(framebuffer) or
+                number - self.keyframe >= self.keyframe_interval):
+            kind = KEYFRAME
+            payload = framebuffer
+            self.keyframe = number
+        else:
+            if framebuffer == previous:
+                return None
+
+            kind = DELTA
+            payload = xor_bytes(framebuffer, previous)
+
+        self.previous = framebuffer
+
+        method = self.method
+        compressed = COMPRESSORS[method][0](payload)
+        if len(compressed) >= len(payload):
+            method = RAW
+            compressed = payload
+
+        return PACKET_FORMAT.pack(kind, method, number,
+                                  len(compressed)) + compressed
+
+
+# Rebuilds framebuffers from packets
+class FrameDecoder(object):
+    def __init__(self):
+        self.framebuffer = None
+
+    # Decode one packet, returning (frame number, framebuffer)
+    def decode(self, packet):
+        kind, method, number, size = PACKET_FORMAT.unpack_from(packet)
+        start = PACKET_FORMAT.size
+        payload = COMPRESSORS[method][1](packet[start:start + size])
+
+        if kind == KEYFRAME:
+            self.framebuffer = payload
+        elif self.framebuffer is None:
+            raise ValueError('Delta packet before the first keyframe')
+        else:
+            self.framebuffer = xor_bytes(self.framebuffer, payload)
+
+        return number, self.framebuffer
+
+
+# Stream of packets handed to send, e.g. a socket write
+# Also usable as an AsyncDriver frontend; send may be a coroutine.
+class FrameStream(object):
+    def __init__(self, send, method=ZLIB, keyframe_interval=120):
+        self.send = send
+        self.encoder = FrameEncoder(method, keyframe_interval)
+
+    def present(self, frame):
+        packet = self.encoder.encode(*frame)
+        if packet is not None:
+            return self.send(packet)
+
+
+# Writes a recording file
+# write() takes frames as they are presented; the writer is also an
+# AsyncDriver frontend.
+class FrameWriter(object):
+    def __init__(self, filename, width=64, height=32, frame_hz=60,
+                 method=ZLIB, keyframe_interval=120):
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER_FORMAT.pack(STREAM_MAGIC, STREAM_VERSION,
+                                           width, height, frame_hz))
+        self.encoder = FrameEncoder(method, keyframe_interval)
+        self.width = width
+        self.height = height
+        self.frames = 0
+        self.packets = 0
+
+    def write(self, number, framebuffer):
+        packet = self.encoder.encode(number, framebuffer)
+        self.frames += 1
+        if packet is not None:
+            self.file.write(packet)
+            self.packets += 1
+
+    def present(self, frame):
+        self.write(*frame)
+
+    def close(self):
+        self.file.close()
+
+
+# Reads a recording file, iterating over (frame number, framebuffer)
+class FrameReader(object):
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            self.data = file.read()
+
+        magic, version, self.width, self.height, self.frame_hz = \
+            HEADER_FORMAT.unpack_from(self.data)
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError('Unsupported recording format')
+
+    def __iter__(self):
+        data = self.data
+        decoder = FrameDecoder()
+        position = HEADER_FORMAT.size
+
+        while position < len(data):
+            size = PACKET_FORMAT.unpack_from(data, position)[3]
+            end = position + PACKET_FORMAT.size + size
+            yield decoder.decode(data[position:end])
+            position = end
+
+
+# Show a recording on screen, speed times faster than it was recorded
+# A speed of 0 plays it as fast as possible.
+def play(filename, screen, speed=1.0, clock=time.monotonic,
+         sleep=time.sleep):
+    reader = FrameReader(filename)
+    start = clock()
+    first = None
+
+    for number, framebuffer in reader:
+        if first is None:
+            first = number
+
+        if speed:
+            due = start + (number - first) / (reader.frame_hz * speed)
+            now = clock()
+            if due > now:
+                sleep(due - now)
+
+        screen.from_bytes(framebuffer)
+        screen.update()
+
+    return reader
+
+
+# Record frames frames of filename headless, presenting every frame
+def record(filename, output, frames=600, cpu_hz=500, method=ZLIB):
+    from cpu import Chip8CPU
+    from screen import HeadlessScreen
+    from scheduler import Scheduler
+
+    screen = HeadlessScreen(filename)
+    cpu = Chip8CPU(screen)
+    cpu.load_rom(filename)
+
+    writer = FrameWriter(output, screen.width, screen.height, method=method)
+    scheduler = Scheduler(cpu, screen, cpu_hz, clock=lambda: 0,
+                          sleep=lambda _: None)
+    scheduler.frame_listeners.append(
+        lambda: writer.write(scheduler.frames, screen.to_bytes()))
+    scheduler.run(frames)
+    writer.close()
+
+    return writer
+
+
+if __name__ == "__main__":
+    import os
+    from screen import Screen, HeadlessScreen
+
+    parser = argparse.ArgumentParser(
+        description='Record or play back Chip8 frame recordings')
+    parser.add_argument('recording')
+    parser.add_argument('--record', metavar='ROM',
+                        help='record ROM headless into the recording first')
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--method', choices=['raw', 'rle', 'zlib'],
+                        default='zlib')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='playback speed, 0 plays as fast as possible')
+    parser.add_argument('--headless', action='store_true')
+    args = parser.parse_args()
+
+    if args.record:
+        method = {'raw': RAW, 'rle': RLE, 'zlib': ZLIB}[args.method]
+        writer = record(args.record, args.recording, args.frames,
+                        method=method)
+        size = os.path.getsize(args.recording)
+        pixels = writer.frames * writer.width * writer.height
+        print('%d frames, %d packets, %d bytes (%d bytes packed, '
+              '%d pixels)' % (writer.frames, writer.packets, size,
+                              pixels // 8, pixels))
+
+    screen = HeadlessScreen() if args.headless else Screen(args.recording)
+    play(args.recording, screen, args.speed)
+    if args.headless:
+        print('%d frames played' % screen.counter)
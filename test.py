@@ -1,120 +1,8 @@
 import curses
-import binascii
 from time import sleep
+from fonts import FONT
 
-sprites = [
-    # 0
-    0xf0,
-    0x90,
-    0x90,
-    0x90,
-    0xf0,
-
-    # 1
-    0x20,
-    0x60,
-    0x20,
-    0x20,
-    0x70,
-
-    # 2
-    0xf0,
-    0x10,
-    0xf0,
-    0x80,
-    0xf0,
-
-    # 3
-    0xf0,
-    0x10,
-    0xf0,
-    0x10,
-    0xf0,
-
-    # 4
-    0x90,
-    0x90,
-    0xf0,
-    0x10,
-    0x10,
-
-    # 5
-    0xf0,
-    0x80,
-    0xf0,
-    0x10,
-    0xf0,
-
-    # 6
-    0xf0,
-    0x80,
-    0xf0,
-    0x90,
-    0xf0,
-
-    # 7
-    0xf0,
-    0x10,
-    0x20,
-    0x40,
-    0x40,
-
-    # 8
-    0xf0,
-    0x90,
-    0xf0,
-    0x90,
-    0xf0,
-
-    # 9
-    0xf0,
-    0x90,
-    0xf0,
-    0x10,
-    0xf0,
-
-    # A
-    0xf0,
-    0x90,
-    0xf0,
-    0x90,
-    0x90,
-
-    # B
-    0xe0,
-    0x90,
-    0xe0,
-    0x90,
-    0xe0,
-
-    # C
-    0xf0,
-    0x80,
-    0x80,
-    0x80,
-    0xf0,
-
-    # D
-    0xe0,
-    0x90,
-    0x90,
-    0x90,
-    0xe0,
-
-    # E
-    0xf0,
-    0x80,
-    0xf0,
-    0x80,
-    0xf0,
-
-    # F
-    0xf0,
-    0x80,
-    0xf0,
-    0x80,
-    0x80
-]
+sprites = list(FONT)
 
 def append_hex(a, b):
     sizeof_b = 0
@@ -132,14 +20,9 @@ def run(stdscr):
     filepath = 'tetris.ch8'
     ram = [0] * 4096
     ram.extend(sprites)
-    counter = 0x200
     with open(filepath, 'rb') as file:
-        byte = file.read(1)
-        while byte:
-            num = int(binascii.hexlify(byte), 16)
-            ram[counter] = num
-            byte = file.read(1)
-            counter += 1
+        data = file.read()
+        ram[0x200:0x200 + len(data)] = data
     v = [0] * 16
     vi = 0
     vd = 0
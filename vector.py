@@ -0,0 +1,604 @@
+import time
+import argparse
+import numpy as np
+from cpu import INITIAL_MEMORY
+from fonts import FONT_ADDRESS, BIG_FONT_ADDRESS
+from quirks import QUIRK_PROFILES, quirk_profile
+
+
+# Lockstep emulator running many Chip8 machines as NumPy arrays
+# The display keeps one 64 bit row per line, as HeadlessScreen does;
+# pixels() unpacks it to (instances, 32, 64).
+# Every step fetches one instruction per machine, groups the machines by
+# opcode class and applies each class as masked array operations. The
+# semantics follow Chip8CPU; where the scalar interpreter would raise
+# (stack overflow, return with an empty stack, fetching past the end of
+# memory) the machine is flagged in crashed and stops executing.
+class VectorChip8(object):
+    def __init__(self, instances, seed=None, quirks=None):
+        self.instances = instances
+        self.memory = np.zeros((instances, 4096), dtype=np.uint8)
+        self.memory[:] = np.frombuffer(INITIAL_MEMORY, dtype=np.uint8)
+        self.v = np.zeros((instances, 16), dtype=np.int64)
+        self.index = np.zeros(instances, dtype=np.int64)
+        self.pc = np.full(instances, 0x200, dtype=np.int64)
+        self.sp = np.zeros(instances, dtype=np.int64)
+        self.stack = np.zeros((instances, 16), dtype=np.int64)
+        self.delay = np.zeros(instances, dtype=np.int64)
+        self.sound = np.zeros(instances, dtype=np.int64)
+        self.display = np.zeros((instances, 32), dtype=np.uint64)
+        self.keys = np.zeros((instances, 16), dtype=np.uint8)
+        self.key_wait = np.full(instances, -1, dtype=np.int64)
+        self.crashed = np.zeros(instances, dtype=bool)
+        self.unimplemented = np.zeros(instances, dtype=np.int64)
+        self.random = np.random.default_rng(seed)
+
+        # Operations Lookup
+        self.operations = {
+            0x0: self.system_operation,
+            0x1: self.jump_to_location,
+            0x2: self.call_subroutine,
+            0x3: self.skip_if_equal,
+            0x4: self.skip_if_not_equal,
+            0x5: self.skip_if_registers_equal,
+            0x6: self.set_register,
+            0x7: self.add_to_register,
+            0x8: self.logical_operation,
+            0x9: self.skip_if_registers_not_equal,
+            0xA: self.set_index,
+            0xB: self.jump_to_location_plus_v0,
+            0xC: self.rand_vx,
+            0xD: self.draw_sprite,
+            0xE: self.key_operation,
+            0xF: self.misc_operation,
+        }
+
+        # Logical operations lookup
+        self.logical_operation_lookup = {
+            0x0: self.load_vy_into_vx,
+            0x1: self.load_or_vy_into_vx,
+            0x2: self.load_and_vy_into_vx,
+            0x3: self.load_xor_vy_into_vx,
+            0x4: self.add_vy_to_vx,
+            0x5: self.subtract_vy_from_vx,
+            0x6: self.shr_vx,
+            0x7: self.subtract_vx_from_vy,
+            0xE: self.shl_vx,
+        }
+
+        # Key operations lookup
+        self.key_operation_lookup = {
+            0x9E: self.skip_if_key_pressed,
+            0xA1: self.skip_if_key_not_pressed,
+        }
+
+        # Misc operations lookup
+        self.misc_operation_lookup = {
+            0x07: self.load_delay_timer_into_vx,
+            0x0A: self.wait_for_key,
+            0x15: self.set_delay_timer,
+            0x18: self.set_sound_timer,
+            0x1E: self.add_vx_to_index,
+            0x29: self.set_index_to_font,
+            0x30: self.set_index_to_big_font,
+            0x33: self.store_bcd,
+            0x55: self.store_registers,
+            0x65: self.load_registers,
+        }
+
+        # Variants of the quirk profile, swapped into the lookups once
+        profile = quirk_profile(quirks)
+        for lookup in (self.operations, self.logical_operation_lookup,
+                       self.key_operation_lookup, self.misc_operation_lookup):
+            for key, handler in lookup.items():
+                if handler.__name__ in profile:
+                    lookup[key] = getattr(self, profile[handler.__name__])
+
+    # Load data into memory of the selected instances (all by default)
+    def load(self, data, offset=0x200, instances=slice(None)):
+        self.memory[instances, offset:offset + len(data)] = \
+            np.frombuffer(bytes(data), dtype=np.uint8)
+
+    def load_rom(self, filename, offset=0x200, instances=slice(None)):
+        with open(filename, 'rb') as file:
+            self.load(file.read(), offset, instances)
+
+    # Key press on the selected instances, resuming those waiting on Fx0A
+    def press(self, key, instances=slice(None)):
+        self.keys[instances, key] = 1
+
+        selected = np.zeros(self.instances, dtype=bool)
+        selected[instances] = True
+        waiting = np.nonzero(selected & (self.key_wait >= 0))[0]
+        self.v[waiting, self.key_wait[waiting]] = key
+        self.pc[waiting] += 2
+        self.key_wait[waiting] = -1
+
+    def release(self, key, instances=slice(None)):
+        self.keys[instances, key] = 0
+
+    # Framebuffers as (instances, 32, 64) pixels
+    def pixels(self):
+        rows = self.display.astype('>u8').view(np.uint8)
+        return np.unpackbits(rows, axis=1).reshape(self.instances, 32, 64)
+
+    # Decrement delay and sound timers, called at 60 Hz
+    def tick_timers(self):
+        self.delay -= self.delay > 0
+        self.sound -= self.sound > 0
+
+    # Execute one instruction on every running instance
+    def step(self):
+        pc = self.pc
+        running = ~self.crashed & (self.key_wait < 0)
+        self.crashed |= running & (pc > 4094)
+        rows = np.nonzero(running & (pc <= 4094))[0]
+        if not len(rows):
+            return 0
+
+        pc = pc[rows]
+        address = rows * 4096 + pc
+        memory = self.memory.reshape(-1)
+        opcode = (memory[address].astype(np.int64) << 8) | \
+            memory[address + 1]
+        self.pc[rows] = pc + 2
+
+        self.dispatch(self.operations, opcode >> 12, rows, opcode)
+        return len(rows)
+
+    # Run cycles steps, returning the aggregate instruction count
+    def run(self, cycles):
+        executed = 0
+        for _ in range(cycles):
+            executed += self.step()
+
+        return executed
+
+    # Apply the handler of every key present, to the rows holding it
+    def dispatch(self, lookup, keys, rows, opcode):
+        counts = np.bincount(keys)
+        for key in np.flatnonzero(counts):
+            handler = lookup.get(int(key), self.not_implemented)
+            if counts[key] == len(rows):
+                handler(rows, opcode)
+            else:
+                selected = keys == key
+                handler(rows[selected], opcode[selected])
+
+    def not_implemented(self, rows, opcode):
+        self.unimplemented[rows] += 1
+
+    # Flag rows whose stack pointer is not on a return address: entries 1
+    # to 15, as a call moves SP before storing
+    def check_stack(self, rows, sp):
+        valid = (sp > 0) & (sp < 16)
+        self.crashed[rows[~valid]] = True
+
+        return valid
+
+    # Operations
+    # 00E0 - CLS, 00EE - RET, 00Cn - SCD, 00Dn - SCU, 00FB - SCR,
+    # 00FC - SCL, 00FE - LOW; anything else in 0nnn is ignored
+    # 00FF - HIGH counts as unimplemented, the display only holds the low
+    # resolution.
+    def system_operation(self, rows, opcode):
+        address = opcode & 0x0FFF
+        self.display[rows[(address == 0x0E0) | (address == 0x0FE)]] = 0
+        self.unimplemented[rows[address == 0x0FF]] += 1
+
+        display = self.display
+        target = rows[address == 0x0FB]
+        display[target] = display[target] >> np.uint64(4)
+        target = rows[address == 0x0FC]
+        display[target] = display[target] << np.uint64(4)
+
+        scroll = (address & 0xFF0 == 0x0C0) | (address & 0xFF0 == 0x0D0)
+        if scroll.any():
+            lines = np.where(address[scroll] & 0x0F0 == 0x0C0, 1, -1) * (
+                address[scroll] & 0xF)
+            self.scroll_vertical(rows[scroll], lines)
+
+        rows = rows[address == 0x0EE]
+        sp = self.sp[rows]
+        valid = self.check_stack(rows, sp)
+        rows = rows[valid]
+        sp = sp[valid]
+        self.pc[rows] = self.stack[rows, sp]
+        self.sp[rows] = sp - 1
+
+    # Scroll rows by lines, down when positive and up when negative
+    def scroll_vertical(self, rows, lines):
+        for count in np.unique(lines):
+            target = rows[lines == count]
+            display = self.display[target]
+            scrolled = np.zeros_like(display)
+            if count >= 0:
+                scrolled[:, count:] = display[:, :32 - count]
+            else:
+                scrolled[:, :32 + count] = display[:, -count:]
+
+            self.display[target] = scrolled
+
+    # 1nnn - JP addr
+    def jump_to_location(self, rows, opcode):
+        self.pc[rows] = opcode & 0x0FFF
+
+    # 2nnn - CALL addr
+    def call_subroutine(self, rows, opcode):
+        sp = self.sp[rows] + 1
+        self.sp[rows] = sp
+        valid = self.check_stack(rows, sp)
+        rows = rows[valid]
+        self.stack[rows, sp[valid]] = self.pc[rows]
+        self.pc[rows] = opcode[valid] & 0x0FFF
+
+    # 3xkk - SE Vx, byte
+    def skip_if_equal(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        self.pc[rows[self.v[rows, x] == opcode & 0xFF]] += 2
+
+    # 4xkk - SNE Vx, byte
+    def skip_if_not_equal(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        self.pc[rows[self.v[rows, x] != opcode & 0xFF]] += 2
+
+    # 5xy0 - SE Vx, Vy
+    def skip_if_registers_equal(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        self.pc[rows[self.v[rows, x] == self.v[rows, y]]] += 2
+
+    # 9xy0 - SNE Vx, Vy
+    def skip_if_registers_not_equal(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        self.pc[rows[self.v[rows, x] != self.v[rows, y]]] += 2
+
+    # 6xkk - LD Vx, byte
+    def set_register(self, rows, opcode):
+        self.v[rows, (opcode >> 8) & 0xF] = opcode & 0xFF
+
+    # 7xkk - ADD Vx, byte
+    def add_to_register(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        self.v[rows, x] = (self.v[rows, x] + (opcode & 0xFF)) & 0xFF
+
+    # Store the low byte of result into vx, then flag into VF, as
+    # Chip8CPU does
+    def store_with_flag(self, rows, x, result, flag):
+        self.v[rows, x] = result & 0xFF
+        self.v[rows, 0xF] = flag
+
+    # 8xyn - logical and arithmetic operations
+    def logical_operation(self, rows, opcode):
+        self.dispatch(self.logical_operation_lookup, opcode & 0xF, rows,
+                      opcode)
+
+    # 8xy0 - LD Vx, Vy
+    def load_vy_into_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        self.v[rows, x] = self.v[rows, y]
+
+    # 8xy1 - OR Vx, Vy
+    def load_or_vy_into_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        self.v[rows, x] = self.v[rows, x] | self.v[rows, y]
+
+    # 8xy2 - AND Vx, Vy
+    def load_and_vy_into_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        self.v[rows, x] = self.v[rows, x] & self.v[rows, y]
+
+    # 8xy3 - XOR Vx, Vy
+    def load_xor_vy_into_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        self.v[rows, x] = self.v[rows, x] ^ self.v[rows, y]
+
+    def load_or_vy_into_vx_reset_vf(self, rows, opcode):
+        self.load_or_vy_into_vx(rows, opcode)
+        self.v[rows, 0xF] = 0
+
+    def load_and_vy_into_vx_reset_vf(self, rows, opcode):
+        self.load_and_vy_into_vx(rows, opcode)
+        self.v[rows, 0xF] = 0
+
+    def load_xor_vy_into_vx_reset_vf(self, rows, opcode):
+        self.load_xor_vy_into_vx(rows, opcode)
+        self.v[rows, 0xF] = 0
+
+    # 8xy4 - ADD Vx, Vy
+    def add_vy_to_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        result = self.v[rows, x] + self.v[rows, y]
+        self.store_with_flag(rows, x, result, result >> 8)
+
+    # 8xy5 - SUB Vx, Vy
+    def subtract_vy_from_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        result = self.v[rows, x] - self.v[rows, y]
+        self.store_with_flag(rows, x, result, result >= 0)
+
+    # 8xy6 - SHR Vx {, Vy}
+    def shr_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        value = self.v[rows, x]
+        self.store_with_flag(rows, x, value >> 1, value & 1)
+
+    def shr_vy(self, rows, opcode):
+        value = self.v[rows, (opcode >> 4) & 0xF]
+        self.store_with_flag(rows, (opcode >> 8) & 0xF, value >> 1, value & 1)
+
+    # 8xy7 - SUBN Vx, Vy
+    def subtract_vx_from_vy(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        y = (opcode >> 4) & 0xF
+        result = self.v[rows, y] - self.v[rows, x]
+        self.store_with_flag(rows, x, result, result >= 0)
+
+    # 8xyE - SHL Vx {, Vy}
+    def shl_vx(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        value = self.v[rows, x]
+        self.store_with_flag(rows, x, value << 1, value >> 7)
+
+    def shl_vy(self, rows, opcode):
+        value = self.v[rows, (opcode >> 4) & 0xF]
+        self.store_with_flag(rows, (opcode >> 8) & 0xF, value << 1,
+                             value >> 7)
+
+    # Annn - LD I, addr
+    def set_index(self, rows, opcode):
+        self.index[rows] = opcode & 0x0FFF
+
+    # Bnnn - JP V0, addr
+    def jump_to_location_plus_v0(self, rows, opcode):
+        self.pc[rows] = (opcode & 0x0FFF) + self.v[rows, 0]
+
+    # Bxnn - JP Vx, addr
+    def jump_to_location_plus_vx(self, rows, opcode):
+        self.pc[rows] = (opcode & 0x0FFF) + self.v[rows, (opcode >> 8) & 0xF]
+
+    # Cxkk - RND Vx, byte
+    def rand_vx(self, rows, opcode):
+        self.v[rows, (opcode >> 8) & 0xF] = self.random.integers(
+            0, 256, size=len(rows)) & (opcode & 0xFF)
+
+    # Dxyn - DRW Vx, Vy, nibble
+    # Same wrapping and clipping as HeadlessScreen.draw_sprite, one
+    # shift, AND and XOR per sprite row. Dxy0 draws a 16x16 sprite.
+    def draw_sprite(self, rows, opcode):
+        x_pos = self.v[rows, (opcode >> 8) & 0xF] % 64
+        y_pos = self.v[rows, (opcode >> 4) & 0xF] % 32
+        large = (opcode & 0xF) == 0
+        num_lines = np.where(large, 16, opcode & 0xF)
+        row_size = np.where(large, 2, 1)
+        index = self.index[rows]
+        collision = np.zeros(len(rows), dtype=bool)
+
+        shift = 64 - 8 * row_size - x_pos
+        left = np.maximum(shift, 0).astype(np.uint64)
+        right = np.maximum(-shift, 0).astype(np.uint64)
+
+        for line in range(int(num_lines.max())):
+            address = index + line * row_size
+            y_coord = y_pos + line
+            drawn = ((line < num_lines) & (y_coord < 32) &
+                     (address + row_size <= 4096))
+
+            target = rows[drawn]
+            y_coord = y_coord[drawn]
+            address = address[drawn]
+            sprite = self.memory[target, address].astype(np.uint64)
+            wide = large[drawn]
+            sprite[wide] = (sprite[wide] << np.uint64(8)) | self.memory[
+                target[wide], address[wide] + 1]
+            bits = (sprite << left[drawn]) >> right[drawn]
+
+            row = self.display[target, y_coord]
+            collision[drawn] |= (row & bits) != 0
+            self.display[target, y_coord] = row ^ bits
+
+        self.v[rows, 0xF] = collision
+
+    # Ex9E - SKP Vx, ExA1 - SKNP Vx
+    def key_operation(self, rows, opcode):
+        self.dispatch(self.key_operation_lookup, opcode & 0xFF, rows, opcode)
+
+    def skip_if_key_pressed(self, rows, opcode):
+        key = self.v[rows, (opcode >> 8) & 0xF] & 0xF
+        self.pc[rows[self.keys[rows, key] == 1]] += 2
+
+    def skip_if_key_not_pressed(self, rows, opcode):
+        key = self.v[rows, (opcode >> 8) & 0xF] & 0xF
+        self.pc[rows[self.keys[rows, key] == 0]] += 2
+
+    # Fxkk - timers, keys and index operations
+    def misc_operation(self, rows, opcode):
+        self.dispatch(self.misc_operation_lookup, opcode & 0xFF, rows,
+                      opcode)
+
+    # Fx0A - LD Vx, K
+    def wait_for_key(self, rows, opcode):
+        self.pc[rows] -= 2
+        self.key_wait[rows] = (opcode >> 8) & 0xF
+
+    # Fx15 - LD DT, Vx
+    def set_delay_timer(self, rows, opcode):
+        self.delay[rows] = self.v[rows, (opcode >> 8) & 0xF]
+
+    # Fx07 - LD Vx, DT
+    def load_delay_timer_into_vx(self, rows, opcode):
+        self.v[rows, (opcode >> 8) & 0xF] = self.delay[rows]
+
+    # Fx1E - ADD I, Vx
+    def add_vx_to_index(self, rows, opcode):
+        self.index[rows] = (self.index[rows] +
+                            self.v[rows, (opcode >> 8) & 0xF]) & 0xFFFF
+
+    # Fx18 - LD ST, Vx
+    def set_sound_timer(self, rows, opcode):
+        self.sound[rows] = self.v[rows, (opcode >> 8) & 0xF]
+
+    # Fx29 - LD F, Vx
+    def set_index_to_font(self, rows, opcode):
+        self.index[rows] = FONT_ADDRESS + (
+            self.v[rows, (opcode >> 8) & 0xF] & 0xF) * 5
+
+    # Fx30 - LD HF, Vx
+    def set_index_to_big_font(self, rows, opcode):
+        self.index[rows] = BIG_FONT_ADDRESS + (
+            self.v[rows, (opcode >> 8) & 0xF] & 0xF) * 10
+
+    # Flag rows whose access to size bytes from index leaves memory,
+    # returning the others
+    def check_memory(self, rows, size):
+        valid = self.index[rows] + size <= 4096
+        self.crashed[rows[~valid]] = True
+
+        return valid
+
+    # Fx33 - LD B, Vx
+    def store_bcd(self, rows, opcode):
+        valid = self.check_memory(rows, 3)
+        rows = rows[valid]
+        value = self.v[rows, (opcode[valid] >> 8) & 0xF]
+        index = self.index[rows]
+
+        self.memory[rows, index] = value // 100
+        self.memory[rows, index + 1] = value // 10 % 10
+        self.memory[rows, index + 2] = value % 10
+
+    # Fx55 - LD [I], Vx
+    def store_registers(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        valid = self.check_memory(rows, x + 1)
+        rows = rows[valid]
+        x = x[valid]
+        index = self.index[rows]
+
+        for register in range(int(x.max(initial=-1)) + 1):
+            stored = register <= x
+            self.memory[rows[stored], index[stored] + register] = \
+                self.v[rows[stored], register]
+
+    # Fx65 - LD Vx, [I]
+    def load_registers(self, rows, opcode):
+        x = (opcode >> 8) & 0xF
+        valid = self.check_memory(rows, x + 1)
+        rows = rows[valid]
+        x = x[valid]
+        index = self.index[rows]
+
+        for register in range(int(x.max(initial=-1)) + 1):
+            loaded = register <= x
+            self.v[rows[loaded], register] = \
+                self.memory[rows[loaded], index[loaded] + register]
+
+    # Fx55 and Fx65 variants leaving I past the last register, or on it
+    def store_registers_advance_index(self, rows, opcode):
+        self.advance_index(self.store_registers, rows, opcode, 1)
+
+    def store_registers_advance_index_by_x(self, rows, opcode):
+        self.advance_index(self.store_registers, rows, opcode, 0)
+
+    def load_registers_advance_index(self, rows, opcode):
+        self.advance_index(self.load_registers, rows, opcode, 1)
+
+    def load_registers_advance_index_by_x(self, rows, opcode):
+        self.advance_index(self.load_registers, rows, opcode, 0)
+
+    def advance_index(self, handler, rows, opcode, extra):
+        handler(rows, opcode)
+        running = ~self.crashed[rows]
+        self.index[rows[running]] += ((opcode[running] >> 8) & 0xF) + extra
+
+
+# Run a Chip8CPU and every instance of a VectorChip8 side by side on
+# filename, comparing their whole state after each instruction. Random
+# numbers (Cxkk) are copied from the scalar CPU, and a scalar exception
+# must crash every instance. Returns the first mismatching step, or None.
+def verify(filename, cycles=10000, instances=8, cycles_per_frame=8,
+           quirks=None):
+    from cpu import Chip8CPU
+    from screen import HeadlessScreen
+
+    cpu = Chip8CPU(HeadlessScreen(filename), quirks=quirks)
+    vector = VectorChip8(instances, quirks=quirks)
+    cpu.load_rom(filename)
+    vector.load_rom(filename)
+
+    for step in range(cycles):
+        if cpu.key_wait is not None:
+            break
+
+        try:
+            cpu.execute_instruction()
+        except Exception:
+            vector.step()
+            return None if vector.crashed.all() else step
+
+        vector.step()
+        if step % cycles_per_frame == cycles_per_frame - 1:
+            cpu.tick_timers()
+            vector.tick_timers()
+
+        if cpu.operand & 0xF000 == 0xC000:
+            x = (cpu.operand & 0x0F00) >> 8
+            vector.v[:, x] = cpu.registers.v[x]
+
+        registers = cpu.registers
+        display = np.array(cpu.screen.display, dtype=np.uint64)
+        memory = np.frombuffer(bytes(cpu.memory), dtype=np.uint8)
+        matches = (
+            (vector.v == list(registers.v)).all() and
+            (vector.index == registers.index).all() and
+            (vector.pc == registers.pc).all() and
+            (vector.sp == registers.sp).all() and
+            (vector.stack == cpu.stack).all() and
+            (vector.delay == registers.delay).all() and
+            (vector.sound == registers.sound).all() and
+            (vector.memory == memory).all() and
+            (vector.display == display).all() and
+            not vector.crashed.any()
+        )
+        if not matches:
+            return step
+
+    return None
+
+
+# Aggregate instructions per second of instances machines on filename
+def measure(filename, instances, cycles, quirks=None):
+    vector = VectorChip8(instances, quirks=quirks)
+    vector.load_rom(filename)
+
+    start = time.perf_counter()
+    executed = vector.run(cycles)
+    return executed / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Lockstep vectorized Chip8 emulator')
+    parser.add_argument('rom')
+    parser.add_argument('--instances', type=int, default=4096)
+    parser.add_argument('--cycles', type=int, default=1000)
+    parser.add_argument('--verify', action='store_true',
+                        help='compare against Chip8CPU instead of timing')
+    parser.add_argument('--quirks', choices=sorted(QUIRK_PROFILES),
+                        default=None, help='compatibility quirk profile')
+    args = parser.parse_args()
+
+    if args.verify:
+        mismatch = verify(args.rom, args.cycles, quirks=args.quirks)
+        print('match' if mismatch is None else 'mismatch at step %d' %
+              mismatch)
+    else:
+        print('%d instructions/s' % measure(args.rom, args.instances,
+                                            args.cycles, args.quirks))